@@ -0,0 +1,276 @@
+"""
+Generators of synthetic inputs for the analysis scripts
+
+Files follow the layout of the real inputs (MiXCR exportAlignments /
+exportClones output, MiXCR assemble reports, TRUST .bam.fa output and
+in-silico generated FASTA), so no repseqio, ART, STAR or MiXCR runs are
+needed to benchmark the scripts. Sequences are random, but reads and clone
+tables are derived from a common pool of clones, so that matches, overlaps
+and extensions are partially correct as in real data.
+"""
+import os
+
+import numpy as np
+
+NUCLEOTIDES = np.frombuffer(b'ACGT', dtype=np.uint8)
+AMINO_ACIDS = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', dtype=np.uint8)
+# Number of rows generated and written at once
+CHUNK_SIZE = 100000
+# Number of ':'-separated fields of -defaultAnchorPoints
+ANCHOR_POINTS_NUMBER = 22
+CDR3_BEGIN = 9
+CDR3_END = 18
+
+
+def random_strings(rng, alphabet, lengths):
+    """
+    Random strings of given lengths over alphabet (uint8 array)
+    """
+    data = alphabet[rng.integers(0, len(alphabet), int(lengths.sum()))].tobytes().decode()
+    ends = np.cumsum(lengths)
+    return [data[e - l:e] for e, l in zip(ends.tolist(), lengths.tolist())]
+
+
+def mutate(rng, sequences, probability, max_substitutions=3):
+    """
+    Introduces up to max_substitutions random substitutions into a fraction
+    of sequences
+    """
+    result = list(sequences)
+    for i in np.flatnonzero(rng.random(len(result)) < probability).tolist():
+        s = bytearray(result[i], 'ascii')
+        for p in rng.integers(0, len(s), rng.integers(1, max_substitutions + 1)).tolist():
+            s[p] = NUCLEOTIDES[rng.integers(0, 4)]
+        result[i] = s.decode()
+    return result
+
+
+class ClonePool:
+    """
+    Pool of clones (nucleotide and amino acid CDR3) shared by all generated files
+    """
+
+    def __init__(self, size, seed=0):
+        rng = np.random.default_rng(seed)
+        self.size = size
+        self.nt = random_strings(rng, NUCLEOTIDES, 3 * rng.integers(8, 20, size))
+        self.aa = ['C%sF' % s for s in random_strings(rng, AMINO_ACIDS, np.array([len(s) // 3 - 2 for s in self.nt]))]
+        self.v = ['TRBV%s-%s*0%s' % (a, b, c) for a, b, c in rng.integers(1, 10, (size, 3)).tolist()]
+        self.j = ['TRBJ%s-%s*0%s' % (a, b, c) for a, b, c in rng.integers(1, 3, (size, 3)).tolist()]
+
+
+def _chunks(n):
+    for start in range(0, n, CHUNK_SIZE):
+        yield start, min(n, start + CHUNK_SIZE)
+
+
+def write_read_to_descr(file_name, pool, reads, seed=0):
+    """
+    exportAlignments -readId -descrR1 output: read i belongs to clone i % pool.size;
+    5% of reads are not aligned
+    """
+    rng = np.random.default_rng(seed)
+    with open(file_name, 'w') as f:
+        f.write('readId\tdescrR1\n')
+        for start, end in _chunks(reads):
+            ids = np.arange(start, end)
+            ids = ids[rng.random(len(ids)) >= 0.05]
+            f.writelines('%d\tGClone|%s|%s|%d\n' % (i, pool.nt[i % pool.size], pool.aa[i % pool.size], i)
+                         for i in ids.tolist())
+
+
+def write_overlaps(file_name, pool, reads, seed=0):
+    """
+    exportAlignments -minFeatureQuality CDR3 -targetDescriptions -nFeature CDR3
+    output for rescued alignments; 60% of alignments are overlaps of two
+    reads, 90% of them of the reads from the same clone
+    """
+    rng = np.random.default_rng(seed)
+    with open(file_name, 'w') as f:
+        f.write('minQualCDR3\ttargetDescriptions\tnSeqCDR3\n')
+        for start, end in _chunks(reads):
+            n = end - start
+            r1 = rng.integers(0, reads, n)
+            same = rng.random(n) < 0.9
+            shift = rng.integers(1, max(2, reads // pool.size), n) * pool.size
+            r2 = np.where(same, (r1 + shift) % max(reads, 1), rng.integers(0, reads, n))
+            overlap = rng.random(n) < 0.6
+            quality = rng.integers(0, 41, n)
+            has_quality = rng.random(n) >= 0.1
+            cdr3 = rng.random(n)
+            new = random_strings(rng, NUCLEOTIDES, rng.integers(20, 50, n))
+            lines = []
+            for k in range(n):
+                description = '[%d] VJOverlap(%d) = L%d.0 + R%d.1 [x]' % (k % 10, 5 + k % 25, r1[k], r2[k]) \
+                    if overlap[k] else 'none'
+                clone = pool.nt[r1[k] % pool.size]
+                if cdr3[k] < 0.1:
+                    clone = ''
+                elif cdr3[k] < 0.15:
+                    clone = new[k]
+                lines.append('%s\t%s\t%s\n' % (quality[k] if has_quality[k] else '', description, clone))
+            f.writelines(lines)
+
+
+def _anchor_points(begin, end):
+    fields = [''] * ANCHOR_POINTS_NUMBER
+    fields[CDR3_BEGIN] = str(begin)
+    fields[CDR3_END] = str(end) if end is not None else ''
+    return ':'.join(fields)
+
+
+def write_extends(file_name, pool, alignments, seed=0):
+    """
+    exportAlignments -descrR1 -defaultAnchorPoints -sequence -targetDescriptions
+    -vHitsWithScore -jHitsWithScore -nFeature CDR3 output for extended
+    alignments; 70% of alignments are paired, 90% of extensions are correct
+    """
+    rng = np.random.default_rng(seed)
+    header = ['descrR1', 'refPoints', 'readSequence', 'targetDescriptions',
+              'allVHitsWithScore', 'allJHitsWithScore', 'nSeqCDR3']
+    with open(file_name, 'w') as f:
+        f.write('\t'.join(header) + '\n')
+        for start, end in _chunks(alignments):
+            n = end - start
+            clones = rng.integers(0, pool.size, n)
+            paired = rng.random(n) < 0.7
+            kind = rng.random((n, 2))
+            extended = rng.integers(1, 12, (n, 2))
+            tails = random_strings(rng, NUCLEOTIDES, rng.integers(0, 30, 2 * n))
+            truth = mutate(rng, [pool.nt[c] for c in clones.tolist()], 0.1)
+            lines = []
+            for k in range(n):
+                clone = clones[k]
+                cdr3 = truth[k]
+                points, sequences, descriptions = [], [], []
+                for r in range(2 if paired[k] else 1):
+                    sequence = cdr3 + tails[2 * k + r]
+                    e = min(int(extended[k, r]), len(cdr3))
+                    if kind[k, r] < 0.3:
+                        description = 'LExtended(%d)' % e
+                    elif kind[k, r] < 0.7:
+                        description = '[%d] + %sExtended(%d)' % (len(cdr3) - e, 'RM'[r], e)
+                    else:
+                        description = 'none'
+                    points.append(_anchor_points(0, len(cdr3) if kind[k, r] < 0.6 else None))
+                    sequences.append(sequence)
+                    descriptions.append(description)
+                lines.append('\t'.join(['GClone|%s|%s' % (pool.nt[clone], pool.aa[clone]), ','.join(points),
+                                        ','.join(sequences), ','.join(descriptions),
+                                        '%s(1200)' % pool.v[clone], '%s(300)' % pool.j[clone], cdr3]) + '\n')
+            f.writelines(lines)
+
+
+def write_assemble_report(file_name, reads):
+    with open(file_name, 'w') as f:
+        f.write('Analysis date: Thu Jan 01 00:00:00 UTC 1970\n')
+        f.write('Final clonotype count: %d\n' % max(1, reads // 100))
+        f.write('Reads used in clonotypes, percent of total: %d (75%%)\n' % (reads * 3 // 4))
+
+
+def write_false_positive_results(file_name, records, kind, seed=0):
+    """
+    JSON lines produced by getFalseOverlaps.py ('overlaps') or
+    getFalseExtensions.py ('extensions') for simulated datasets
+    """
+    rng = np.random.default_rng(seed)
+    with open(file_name, 'w') as f:
+        for start, end in _chunks(records):
+            n = end - start
+            clones = 10 ** rng.integers(2, 5, n)
+            coverage = 10 ** rng.integers(4, 6, n)
+            length = rng.choice([50, 75, 100], n)
+            total = rng.integers(1000, 100000, (n, 2))
+            false = (total * rng.random((n, 2)) * 0.01).astype(np.int64)
+            lines = []
+            for k in range(n):
+                prefix = 'fpEstimation_clones%d_coverage%d_length%d_seqHS25' % (clones[k], coverage[k], length[k])
+                if kind == 'overlaps':
+                    lines.append('{"inputFile": "%s_overlaps.txt", "clonesTotal": %d, "totalAlignments": %d, '
+                                 '"totalAlignmentsWithCDR3": %d, "totalOverlaps": %d, "hqOverlaps": %d, '
+                                 '"correctOverlaps": %d, "overlapsFromDifferentClones": %d, '
+                                 '"overlapsProducingNewCDR3": %d, "hqOverlapsProducingNewCDR3": %d, '
+                                 '"newCDR3Diversity": %d, "hqNewCDR3Diversity": %d}\n'
+                                 % (prefix, 2 * total[k, 0], 2 * total[k, 0], total[k, 0], total[k, 1], total[k, 1] // 2,
+                                    total[k, 1] - false[k, 1], false[k, 1], false[k, 0], false[k, 0] // 2,
+                                    false[k, 0] // 3, false[k, 0] // 6))
+                else:
+                    lines.append('{"inputFile": "%s_extends.txt", "clonesTotal": %d, "totalRExtensions": %d, '
+                                 '"totalLExtensions": %d, "falseRExtensions": %d, "falseLExtensions": %d}\n'
+                                 % (prefix, total[k, 0] + total[k, 1], total[k, 0], total[k, 1], false[k, 0], false[k, 1]))
+            f.writelines(lines)
+
+
+def write_in_silico_fasta(file_name, pool):
+    """
+    In-silico generated clones (repseqio exportCloneSequence output)
+    """
+    with open(file_name, 'w') as f:
+        f.writelines('>clone%d|%s|%s|%s|%s\n%s\n' % (i, pool.nt[i], pool.aa[i], pool.v[i], pool.j[i], pool.nt[i])
+                     for i in range(pool.size))
+
+
+def _found_clones(pool, clones, rng):
+    # 80% of found clones are true ones (some with sequencing errors), the rest are random
+    true = rng.random(clones) < 0.8
+    ids = rng.integers(0, pool.size, clones)
+    random_nt = random_strings(rng, NUCLEOTIDES, 3 * rng.integers(8, 20, clones))
+    nt = mutate(rng, [pool.nt[i] if t else r for i, t, r in zip(ids.tolist(), true.tolist(), random_nt)], 0.2)
+    return ids, nt
+
+
+def write_mixcr_clones(file_name, pool, clones, seed=0):
+    """
+    MiXCR exportClones output
+    """
+    rng = np.random.default_rng(seed)
+    ids, nt = _found_clones(pool, clones, rng)
+    counts = np.sort(rng.integers(1, 1000, clones))[::-1]
+    header = ['cloneId', 'cloneCount', 'cloneFraction', 'allVHitsWithScore', 'allDHitsWithScore',
+              'allJHitsWithScore', 'allCHitsWithScore', 'nSeqCDR3', 'aaSeqCDR3']
+    with open(file_name, 'w') as f:
+        f.write('\t'.join(header) + '\n')
+        f.writelines('%d\t%d\t%s\t%s(1200)\t\t%s(300)\tTRBC1*00(100)\t%s\t%s\n'
+                     % (k, counts[k], counts[k] / float(counts.sum()), pool.v[i], pool.j[i], nt[k], pool.aa[i])
+                     for k, i in enumerate(ids.tolist()))
+
+
+def write_trust_fa(file_name, pool, clones, seed=0):
+    """
+    TRUST 2.1 .bam.fa output (10 header fields), as produced by the in-silico pipeline
+    """
+    rng = np.random.default_rng(seed)
+    ids, nt = _found_clones(pool, clones, rng)
+    contigs = random_strings(rng, NUCLEOTIDES, rng.integers(10, 40, clones))
+    with open(file_name, 'w') as f:
+        f.write('## Command: trust (synthetic data)\n')
+        f.writelines('>%s+est_clonal_freq=%s+seq_length=%d+est_lib_size=%d+%s+%s+'
+                     'TRBC1|chr7:142791694-142792080+%s+minus_log_Eval=%s+%s\n%s%s\n'
+                     % (os.path.basename(file_name), rng.random(), len(nt[k]) + len(contigs[k]),
+                        clones * 10, pool.v[i], pool.j[i], pool.aa[i], 10 * rng.random(), nt[k], contigs[k], nt[k])
+                     for k, i in enumerate(ids.tolist()))
+
+
+# Increment when files written by write_comparison_directory change
+COMPARISON_VERSION = 2
+# (read length, paired) combinations expected by plotMiXCRvsTRUST.py
+COMPARISON_SAMPLES = [(length, paired) for paired in [True, False] for length in [50, 75, 100]]
+
+
+def write_comparison_directory(directory, clones, seed=0):
+    """
+    Directory layout used by plotMiXCRvsTRUST.py (star/, mixcr/, trust/ and
+    in_silico_TRB.fasta) with clones clones in each table
+    """
+    pool = ClonePool(clones, seed)
+    for d in ['star', 'mixcr', 'trust']:
+        if not os.path.exists(os.path.join(directory, d)):
+            os.makedirs(os.path.join(directory, d))
+    write_in_silico_fasta(os.path.join(directory, 'in_silico_TRB.fasta'), pool)
+    for k, (length, paired) in enumerate(COMPARISON_SAMPLES):
+        layout = 'paired' if paired else 'single'
+        open(os.path.join(directory, 'star', 'in_silico_RNA_Seq_%sbp.hg37.%s.sorted.bam' % (length, layout)), 'w').close()
+        write_mixcr_clones(os.path.join(directory, 'mixcr', 'in_silico_RNA_Seq_%sbp.%s.txt' % (length, layout)),
+                           pool, clones, seed + 2 * k + 1)
+        write_trust_fa(os.path.join(directory, 'trust', 'in_silico_RNA_Seq_%sbp.hg37.%s.sorted.bam.fa' % (length, layout)),
+                       pool, clones, seed + 2 * k + 2)
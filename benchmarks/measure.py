@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""
+Runs a command and writes its exit status, wall time and peak RSS as JSON
+
+Used by run.py as a small intermediate process: on Linux peak RSS of a
+child includes the memory of the process it was forked from, so stages are
+not started directly from the benchmark runner, which holds generated data.
+
+    python measure.py result.json command [arguments...]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+if __name__ == '__main__':
+    start = time.time()
+    process = subprocess.Popen(sys.argv[2:])
+    # wait4 reports resource usage of this child (and of its own children) only
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    with open(sys.argv[1], 'w') as f:
+        json.dump({'status': process.returncode, 'wall': time.time() - start,
+                   'maxrss': usage.ru_maxrss * MAXRSS_UNIT}, f)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the analysis scripts on synthetic inputs
+
+Each stage runs in a separate process; wall time, peak RSS (including
+worker processes) and processed rows per second are recorded for every
+input size and compared against a stored baseline:
+
+    python benchmarks/run.py --sizes 1000,10000,100000
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+
+Generated inputs are kept in the work directory and reused by later runs.
+The exit status is non-zero if a stage failed or regressed.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+
+import generators
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.dirname(BENCHMARKS)
+
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5]
+# Smaller increases of wall time are not reported as regressions, seconds
+MIN_WALL_INCREASE = 1.0
+
+
+def _prepared(file_name, write):
+    """
+    Generates a file unless it was generated by a previous run
+    """
+    if not os.path.exists(file_name):
+        tmp_name = file_name + '.tmp'
+        write(tmp_name)
+        os.rename(tmp_name, file_name)
+    return file_name
+
+
+def _pool(size, seed):
+    return generators.ClonePool(max(10, size // 100), seed)
+
+
+def prepare_overlaps(directory, size, seed):
+    pool = _pool(size, seed)
+    read_to_descr = _prepared(os.path.join(directory, 'readToDescr.txt'),
+                              lambda f: generators.write_read_to_descr(f, pool, size, seed))
+    overlaps = _prepared(os.path.join(directory, 'overlaps.txt'),
+                         lambda f: generators.write_overlaps(f, pool, size, seed))
+    report = _prepared(os.path.join(directory, 'assemble.report'),
+                       lambda f: generators.write_assemble_report(f, size))
+    return [os.path.join(SCRIPTS, 'getFalseOverlaps.py'), read_to_descr, overlaps, report]
+
+
+def prepare_extensions(directory, size, seed):
+    pool = _pool(size, seed)
+    extends = _prepared(os.path.join(directory, 'extends.txt'),
+                        lambda f: generators.write_extends(f, pool, size, seed))
+    report = _prepared(os.path.join(directory, 'assemble.report'),
+                       lambda f: generators.write_assemble_report(f, size))
+    return [os.path.join(SCRIPTS, 'getFalseExtensions.py'), extends, report]
+
+
+def prepare_overlaps_stat(directory, size, seed):
+    results = _prepared(os.path.join(directory, 'falseOverlapsResults.txt'),
+                        lambda f: generators.write_false_positive_results(f, size, 'overlaps', seed))
+    return [os.path.join(SCRIPTS, 'falseOverlapsStat.py'), results]
+
+
+def prepare_extensions_stat(directory, size, seed):
+    results = _prepared(os.path.join(directory, 'falseExtensionsResults.txt'),
+                        lambda f: generators.write_false_positive_results(f, size, 'extensions', seed))
+    return [os.path.join(SCRIPTS, 'falseExtensionsStat.py'), results]
+
+
+def prepare_comparison_stats(directory, size, seed):
+    def write(file_name):
+        generators.write_comparison_directory(directory, size, seed)
+        open(file_name, 'w').close()
+    # inputs written by an older version of the generators are replaced
+    _prepared(os.path.join(directory, 'generated.v%d' % generators.COMPARISON_VERSION), write)
+    # cold run of the statistics step only, the figure is not rendered
+    return [os.path.join(SCRIPTS, 'plotMiXCRvsTRUST.py'), '--stats-only', '--force']
+
+
+# name -> (input generator, rows processed per unit of size, maximal default size)
+STAGES = OrderedDict([
+    ('getFalseOverlaps', (prepare_overlaps, 1, 10 ** 7)),
+    ('getFalseExtensions', (prepare_extensions, 1, 10 ** 7)),
+    ('falseOverlapsStat', (prepare_overlaps_stat, 1, 10 ** 7)),
+    ('falseExtensionsStat', (prepare_extensions_stat, 1, 10 ** 7)),
+    # size is the number of clones per clone table, there are 12 tables
+    ('plotMiXCRvsTRUST.stats', (prepare_comparison_stats, 2 * len(generators.COMPARISON_SAMPLES), 10 ** 5)),
+])
+
+
+def run_stage(command, directory, env):
+    """
+    Runs a stage in a child process (through measure.py)
+
+    Returns:
+        (exit status, wall time in seconds, peak RSS in bytes)
+    """
+    measurement = os.path.join(directory, 'measurement.json')
+    with open(os.path.join(directory, 'stage.log'), 'w') as log:
+        subprocess.call([sys.executable, os.path.join(BENCHMARKS, 'measure.py'), measurement, sys.executable] + command,
+                        cwd=directory, env=env, stdout=log, stderr=log)
+    with open(measurement) as f:
+        result = json.load(f)
+    return result['status'], result['wall'], result['maxrss']
+
+
+def compare(results, baseline, tolerance, min_wall=MIN_WALL_INCREASE):
+    """
+    Finds stages which are slower or use more memory than in the baseline
+
+    Arguments:
+        tolerance -- allowed relative increase
+        min_wall  -- wall time increases below this number of seconds are
+                     ignored (short runs are dominated by interpreter startup)
+
+    Returns:
+        list of messages
+    """
+    reference = dict(((r['stage'], r['size']), r) for r in baseline['results'] if r['status'] == 0)
+    messages = []
+    for r in results:
+        base = reference.get((r['stage'], r['size']))
+        if base is None or r['status'] != 0:
+            continue
+        for key in ['wall', 'maxrss']:
+            if key == 'wall' and r[key] - base[key] < min_wall:
+                continue
+            if r[key] > base[key] * (1 + tolerance):
+                messages.append('%s (size %s): %s %.3g -> %.3g (+%.0f%%)' % (
+                    r['stage'], r['size'], key, base[key], r[key], 100.0 * (r[key] / base[key] - 1)))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the analysis scripts on synthetic inputs')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma separated input sizes (alignments, records or clones; default: %(default)s)')
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma separated stages (default: all)')
+    parser.add_argument('--no-limits', action='store_true',
+                        help='run stages for sizes above their default limits (e.g. 10^7 clones for stats)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generators (default: %(default)s)')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'rnaseq-benchmarks'),
+                        help='directory for generated inputs (default: %(default)s)')
+    parser.add_argument('--baseline', default=os.path.join(BENCHMARKS, 'baseline.json'),
+                        help='baseline to compare with (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative increase of wall time and peak RSS (default: %(default)s)')
+    parser.add_argument('--min-wall-increase', type=float, default=MIN_WALL_INCREASE,
+                        help='ignore wall time increases below this number of seconds (default: %(default)s)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--save-baseline', metavar='FILE', help='write results as a new baseline')
+    args = parser.parse_args()
+
+    sizes = [int(float(s)) for s in args.sizes.split(',')]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([SCRIPTS] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    # measure cold runs
+    env['MATCH_CACHE'] = ''
+
+    results = []
+    failed = False
+    print('%-24s %10s %10s %12s %12s  %s' % ('stage', 'size', 'wall, s', 'peak RSS, MB', 'rows/s', 'status'))
+    for stage in args.stages.split(','):
+        prepare, rows_per_size, max_size = STAGES[stage]
+        for size in sizes:
+            if size > max_size and not args.no_limits:
+                continue
+            directory = os.path.join(args.work_dir, '%s_%s_seed%s' % (stage, size, args.seed))
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            command = prepare(directory, size, args.seed)
+            status, wall, maxrss = run_stage(command, directory, env)
+            rows = rows_per_size * size
+            result = OrderedDict([('stage', stage), ('size', size), ('rows', rows), ('status', status),
+                                  ('wall', wall), ('maxrss', maxrss), ('rows_per_s', rows / wall)])
+            results.append(result)
+            failed |= status != 0
+            print('%-24s %10s %10.2f %12.1f %12.0f  %s' % (
+                stage, size, wall, maxrss / 2.0 ** 20, rows / wall,
+                'ok' if status == 0 else 'failed (see %s)' % os.path.join(directory, 'stage.log')))
+
+    for file_name, selected in [(args.output, results),
+                                (args.save_baseline, [r for r in results if r['status'] == 0])]:
+        if file_name:
+            report = OrderedDict([('python', platform.python_version()), ('platform', platform.platform()),
+                                  ('cpus', os.cpu_count()), ('results', selected)])
+            with open(file_name, 'w') as f:
+                json.dump(report, f, indent=1)
+                f.write('\n')
+
+    regressions = []
+    if not args.save_baseline and args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_wall_increase)
+        print('\nCompared with %s (tolerance %.0f%%): %s' % (
+            args.baseline, 100 * args.tolerance, '%s regression(s)' % len(regressions) if regressions else 'ok'))
+        for message in regressions:
+            print('  ' + message)
+
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
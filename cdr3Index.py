@@ -0,0 +1,317 @@
+"""
+Indexed approximate search of CDR3 sequences
+
+Replaces a linear scan over fuzzy regular expressions with a pigeonhole
+filter which selects a few candidates verified with an exact edit distance
+computation: every true sequence is split into maxerr + 1 pieces, and a
+sequence within k errors of the query has at least maxerr + 1 - k pieces
+occurring exactly in the query. In end-to-end search pieces are shifted by
+at most k, and distances are tried in increasing order, so most queries
+(which match at distance 0 or 1) stop after a few dictionary lookups. In
+substring search pieces may occur anywhere in the query.
+"""
+import numpy as np
+
+
+def _common_prefix_length(a, b):
+    # binary search with slice comparisons, which are much faster than
+    # comparing characters one by one
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix_length(a, b):
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def edit_distance(a, b, maxerr):
+    """
+    Levenshtein distance between two sequences (end-to-end alignment)
+
+    Arguments:
+        a, b   -- sequences to compare
+        maxerr -- maximal distance of interest
+
+    Returns:
+        the distance, or maxerr + 1 if it exceeds maxerr
+    """
+
+    if abs(len(a) - len(b)) > maxerr:
+        return maxerr + 1
+    # common prefix and suffix do not change the distance
+    prefix = _common_prefix_length(a, b)
+    a, b = a[prefix:], b[prefix:]
+    suffix = _common_suffix_length(a, b)
+    if suffix:
+        a, b = a[:-suffix], b[:-suffix]
+    # only cells within maxerr of the diagonal are computed, the rest are
+    # known to exceed maxerr
+    worse = maxerr + 1
+    prev = [j if j <= maxerr else worse for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        cur = [worse] * (len(b) + 1)
+        if i <= maxerr:
+            cur[0] = i
+        ca = a[i - 1]
+        best = cur[0]
+        for j in range(max(1, i - maxerr), min(len(b), i + maxerr) + 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != b[j - 1]))
+            cur[j] = d
+            if d < best:
+                best = d
+        if best > maxerr:
+            return worse
+        prev = cur
+    return prev[-1] if prev[-1] <= maxerr else worse
+
+
+def substring_distance(pattern, text, maxerr):
+    """
+    Minimal edit distance between pattern and any substring of text
+
+    Arguments:
+        pattern -- sequence that should be fully aligned
+        text    -- sequence to search pattern in
+        maxerr  -- maximal distance of interest
+
+    Returns:
+        the distance, or maxerr + 1 if it exceeds maxerr
+    """
+
+    if pattern in text:
+        return 0
+    # rows correspond to pattern positions, leading gaps in text are free
+    prev = [0] * (len(text) + 1)
+    for i in range(1, len(pattern) + 1):
+        cur = [i] + [0] * len(text)
+        cp = pattern[i - 1]
+        for j in range(1, len(text) + 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (cp != text[j - 1]))
+        if min(cur) > maxerr:
+            return maxerr + 1
+        prev = cur
+    best = min(prev)
+    return best if best <= maxerr else maxerr + 1
+
+
+class CDR3Index:
+    """
+    An index over a list of sequences, which finds the closest sequence
+    (by edit distance) to a query
+
+    Index is built on the first query, or explicitly with build().
+    """
+
+    def __init__(self, values, end_to_end=True):
+        """
+        Arguments:
+            values     -- list of sequences to search in; the first one wins ties
+            end_to_end -- if True, whole value is aligned with the whole query,
+                          otherwise value[3:-3] is searched as a substring of the query
+        """
+        self.values = list(values)
+        self.end_to_end = end_to_end
+        self.patterns = self.values if end_to_end else [v[3:-3] for v in self.values]
+        # number of pieces of each pattern in the pigeonhole filter
+        self.npieces = 0
+
+    def build(self, maxerr=4):
+        """
+        Builds the index if it was not built yet
+
+        Arguments:
+            maxerr -- maximal number of errors of future queries (the index
+                      is rebuilt for queries with more errors)
+        """
+        if self.npieces >= maxerr + 1:
+            return
+        if self.end_to_end:
+            self._build_pieces(maxerr + 1)
+        else:
+            self._build_substring_pieces(maxerr + 1)
+
+    def _build_pieces(self, npieces):
+        # first occurrence of each value, for exact hits
+        self.exact = {}
+        # (pattern length, piece number) -> piece -> pids in increasing order
+        self.pieces = {}
+        for pid, pattern in enumerate(self.patterns):
+            self.exact.setdefault(pattern, pid)
+            for i, (start, end) in enumerate(self._bounds(len(pattern), npieces)):
+                self.pieces.setdefault((len(pattern), i), {}).setdefault(pattern[start:end], []).append(pid)
+        self.npieces = npieces
+
+    def _build_substring_pieces(self, npieces):
+        # piece -> pid * npieces + piece number, for every piece of every pattern
+        self.substring_pieces = {}
+        for pid, pattern in enumerate(self.patterns):
+            for i, (start, end) in enumerate(self._bounds(len(pattern), npieces)):
+                self.substring_pieces.setdefault(pattern[start:end], []).append(pid * npieces + i)
+        self.piece_lengths = sorted(set(len(piece) for piece in self.substring_pieces))
+        self.npieces = npieces
+
+    @staticmethod
+    def _bounds(length, npieces):
+        """
+        (start, end) of pieces of a pattern of the given length
+        """
+        return [(i * length // npieces, (i + 1) * length // npieces) for i in range(npieces)]
+
+    def _pigeonhole_candidates(self, seq, k):
+        """
+        pids of patterns which may be within k errors of the query, in
+        increasing order
+        """
+        found = {}
+        for length in range(max(0, len(seq) - k), len(seq) + k + 1):
+            for i, (start, end) in enumerate(self._bounds(length, self.npieces)):
+                slot = self.pieces.get((length, i))
+                if slot is None:
+                    continue
+                piece_pids = set()
+                # k errors shift the piece by at most k positions
+                for s in range(max(0, start - k), min(len(seq) - (end - start), start + k) + 1):
+                    pids = slot.get(seq[s:s + end - start])
+                    if pids is not None:
+                        piece_pids.update(pids)
+                for pid in piece_pids:
+                    found[pid] = found.get(pid, 0) + 1
+        # k errors destroy at most k pieces
+        return sorted(pid for pid, n in found.items() if n >= self.npieces - k)
+
+    def _substring_candidates(self, seq, maxerr):
+        """
+        (lower bound of the distance, pid) of patterns which may occur in the
+        query with at most maxerr errors, in increasing order
+        """
+        found = set()
+        for length in self.piece_lengths:
+            for piece in set(seq[i:i + length] for i in range(len(seq) - length + 1)):
+                found.update(self.substring_pieces.get(piece, ()))
+        counts = {}
+        for code in found:
+            pid = code // self.npieces
+            counts[pid] = counts.get(pid, 0) + 1
+        # every error destroys at most one piece
+        return sorted((self.npieces - n, pid) for pid, n in counts.items() if self.npieces - n <= maxerr)
+
+    def search(self, seq, maxerr):
+        """
+        Finds the closest value to the query
+
+        Arguments:
+            seq    -- query sequence
+            maxerr -- maximal allowed number of errors
+
+        Returns:
+            (index of the matched value, distance), or (None, None) if there
+            is no value within maxerr errors
+        """
+        self.build(maxerr)
+
+        if self.end_to_end:
+            if seq in self.exact:
+                return self.exact[seq], 0
+            for k in range(1, maxerr + 1):
+                # there are no matches with less than k errors, so the first
+                # candidate within k errors is the closest one
+                for pid in self._pigeonhole_candidates(seq, k):
+                    if edit_distance(self.patterns[pid], seq, k) <= k:
+                        return pid, k
+            return None, None
+
+        best, best_err = None, maxerr + 1
+        for bound, pid in self._substring_candidates(seq, maxerr):
+            if bound > best_err:
+                break
+            # ties are won by the lowest pid
+            if best is not None and bound == best_err and pid > best:
+                continue
+            err = substring_distance(self.patterns[pid], seq, best_err)
+            if err < best_err or (err == best_err and best is not None and pid < best):
+                best, best_err = pid, err
+        if best is None:
+            return None, None
+        return best, best_err
+
+
+class SubstringMatcher:
+    """
+    Aho-Corasick automaton over a set of patterns, which finds all patterns
+    occurring as exact substrings in a stream of texts in a single pass
+    """
+
+    def __init__(self, patterns):
+        """
+        Arguments:
+            patterns -- list of distinct non-empty sequences to search for
+        """
+        self.patterns = list(patterns)
+        goto = [{}]
+        output = [[]]
+        for pid, pattern in enumerate(self.patterns):
+            state = 0
+            for c in pattern:
+                if c not in goto[state]:
+                    goto[state][c] = len(goto)
+                    goto.append({})
+                    output.append([])
+                state = goto[state][c]
+            output[state].append(pid)
+
+        # breadth-first construction of failure links, turning the trie
+        # into a complete automaton
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = list(goto[0].values())
+        for state in queue:
+            output[state] = output[state] + output[fail[state]]
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            for c, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(c, 0)
+                queue.append(child)
+        for state in range(len(goto)):
+            # drop transitions leading back to the root, they are the default
+            delta[state] = dict((c, s) for c, s in delta[state].items() if s)
+        self.delta = delta
+        self.output = [tuple(o) for o in output]
+
+    def search(self, texts):
+        """
+        Finds occurrences of all patterns in texts
+
+        Arguments:
+            texts -- iterable of sequences (None for missing values)
+
+        Returns:
+            list with one int array per pattern: indices of texts containing
+            the pattern, in increasing order
+        """
+        delta, output = self.delta, self.output
+        hits = [[] for _ in self.patterns]
+        last = [-1] * len(self.patterns)
+        for i, text in enumerate(texts):
+            if not isinstance(text, str):
+                continue
+            state = 0
+            for c in text:
+                state = delta[state].get(c, 0)
+                for pid in output[state]:
+                    if last[pid] != i:
+                        last[pid] = i
+                        hits[pid].append(i)
+        return [np.array(h, dtype=np.int64) for h in hits]
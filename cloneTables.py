@@ -0,0 +1,248 @@
+"""
+Loaders for clone tables produced by the analysed software
+"""
+import gzip
+import io
+import os
+import numpy as np
+import pandas as pd
+
+# Columns of MiXCR exportClones output required for the analysis
+MIXCR_COLUMNS = ['nSeqCDR3', 'aaSeqCDR3', 'allVHitsWithScore', 'allJHitsWithScore']
+# Increment when layout of the sidecar cache changes
+MIXCR_CACHE_VERSION = 1
+
+TCR_CHAINS = ['TRA', 'TRB', 'TRD', 'TRG']
+IG_CHAINS = ['IGH', 'IGK', 'IGL']
+
+# Fields of '+'-separated TRUST .fa headers; 'contig' is the sequence line
+TRUST_2_FA_FIELDS = ['file', 'est_clonal_freq', 'seq_length', 'est_lib_size', 'V', 'J',
+                     'reportgene', 'aaSeqCDR3', 'minus_log_Eval', 'nSeqCDR3']
+TRUST_3_FA_FIELDS = ['file', 'est_clonal_exp', 'contig_reads_count', 'seq_length', 'est_lib_size', 'V', 'J',
+                     'reportgene', 'aaSeqCDR3', 'minus_log_Eval', 'nSeqCDR3']
+# Columns of TRUST 3 .txt tables renamed to the names used for .fa fields
+TRUST_3_TXT_COLUMNS = {'Vgene': 'V', 'Jgene': 'J', 'cdr3aa': 'aaSeqCDR3', 'cdr3dna': 'nSeqCDR3'}
+# Fields of '|'-separated headers of in-silico generated FASTA
+IN_SILICO_FIELDS = ['name', 'nSeqCDR3', 'aaSeqCDR3']
+
+
+def _top_hit(hits):
+    """
+    Gene name of the best hit from allXHitsWithScore column
+    """
+    return hits.str.extract("^([^(,]+)", expand=False)
+
+
+def _file_signature(file_name):
+    st = os.stat(file_name)
+    return np.array([st.st_mtime, st.st_size, MIXCR_CACHE_VERSION], dtype=np.float64)
+
+
+def _save_columns(file_name, df, signature):
+    arrays = {'signature': signature}
+    for c in df.columns:
+        values = df[c].astype('category')
+        arrays['codes_%s' % c] = values.cat.codes.values.astype(np.int32)
+        arrays['categories_%s' % c] = np.array(values.cat.categories, dtype=str)
+    tmp_name = '%s.tmp%s' % (file_name, os.getpid())
+    with open(tmp_name, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmp_name, file_name)
+
+
+def _load_columns(file_name, columns, signature):
+    with np.load(file_name, allow_pickle=False) as data:
+        if not np.array_equal(data['signature'], signature):
+            return None
+        return pd.DataFrame(dict(
+            (c, pd.Categorical.from_codes(data['codes_%s' % c], data['categories_%s' % c].astype(object)))
+            for c in columns), columns=columns)
+
+
+def read_mixcr_clones(file_name, cache=True):
+    """
+    Reads MiXCR clones (exportClones output) keeping only the columns
+    required for the analysis
+
+    Parsed table is stored in a binary sidecar file (<file_name>.npz) which
+    is used on subsequent calls until the source file modification time or
+    size changes.
+
+    Arguments:
+        file_name -- path to exportClones output
+        cache     -- whether to use (and create) the sidecar cache
+
+    Returns:
+        DataFrame with columns:
+            nSeqCDR3  -- nucleotide CDR3 sequence
+            aaSeqCDR3 -- amino acid CDR3 sequence
+            V, J      -- top V and J hits (categorical)
+            chain     -- chain of the top V hit, nan if not a TCR/IG gene (categorical)
+    """
+
+    columns = ['nSeqCDR3', 'aaSeqCDR3', 'V', 'J', 'chain']
+    cache_file = file_name + '.npz'
+    signature = _file_signature(file_name)
+    if cache and os.path.exists(cache_file):
+        try:
+            clones = _load_columns(cache_file, columns, signature)
+        except (IOError, ValueError, KeyError):
+            clones = None
+        if clones is not None:
+            clones['nSeqCDR3'] = clones['nSeqCDR3'].astype(object)
+            clones['aaSeqCDR3'] = clones['aaSeqCDR3'].astype(object)
+            return clones
+
+    raw = pd.read_table(file_name, usecols=MIXCR_COLUMNS, dtype=str)
+    clones = pd.DataFrame({
+        'nSeqCDR3': raw['nSeqCDR3'],
+        'aaSeqCDR3': raw['aaSeqCDR3'],
+        'V': _top_hit(raw['allVHitsWithScore']).astype('category'),
+        'J': _top_hit(raw['allJHitsWithScore']).astype('category'),
+        'chain': raw['allVHitsWithScore'].str.extract("^(TR[ABDG]|IG[HKL])V", expand=False).astype('category')
+    }, columns=columns)
+
+    if cache:
+        try:
+            _save_columns(cache_file, clones, signature)
+        except (IOError, OSError):
+            # read-only location, cache is just an optimisation
+            pass
+    return clones
+
+
+def open_text(file_name):
+    """
+    Opens a (possibly gzipped) text file for reading
+    """
+    if file_name.endswith('.gz'):
+        return io.TextIOWrapper(io.BufferedReader(gzip.open(file_name, 'rb')))
+    return io.open(file_name, 'r')
+
+
+class ColumnBuffer:
+    """
+    Growable preallocated column of values
+    """
+
+    def __init__(self, capacity=1024):
+        self.data = np.empty(max(capacity, 1), dtype=object)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            data = np.empty(2 * len(self.data), dtype=object)
+            data[:self.size] = self.data
+            self.data = data
+        self.data[self.size] = value
+        self.size += 1
+
+    def values(self):
+        return self.data[:self.size]
+
+
+def _initial_capacity(file_name, bytes_per_record):
+    size = os.path.getsize(file_name)
+    # compressed files are ~4 times smaller
+    return (4 * size if file_name.endswith('.gz') else size) // bytes_per_record + 1
+
+
+def _to_frame(file_name, records, fields, bytes_per_record):
+    columns = [ColumnBuffer(_initial_capacity(file_name, bytes_per_record)) for _ in fields]
+    for record in records:
+        for column, value in zip(columns, record):
+            column.append(value)
+    return pd.DataFrame(dict((f, c.values()) for f, c in zip(fields, columns)), columns=list(fields))
+
+
+def iter_trust_fa(file_name, fields):
+    """
+    Streams records from TRUST .fa output (plain or gzipped, TRUST 2.1 or
+    TRUST 3 header layout)
+
+    Arguments:
+        file_name -- path to the .fa / .fa.gz file
+        fields    -- names of fields to extract (see TRUST_2_FA_FIELDS,
+                     TRUST_3_FA_FIELDS; 'contig' for the contig sequence);
+                     'key=value' fields are returned without the key
+
+    Returns:
+        generator of tuples with requested fields
+    """
+
+    layouts = {}
+    for layout in [TRUST_2_FA_FIELDS, TRUST_3_FA_FIELDS]:
+        layouts[len(layout)] = [layout.index(f) if f in layout else None for f in fields]
+    contig = [f == 'contig' for f in fields]
+    with open_text(file_name) as f:
+        header = None
+        for line in f:
+            if line.startswith("#"):
+                continue
+            if header is not None:
+                split = header[1:].rstrip('\r\n').split("+")
+                positions = layouts.get(len(split))
+                if positions is None:
+                    raise ValueError("Unknown TRUST header layout in %s: %s" % (file_name, header))
+                record = []
+                for i in range(len(fields)):
+                    if contig[i]:
+                        record.append(line.rstrip('\r\n'))
+                    elif positions[i] is None:
+                        raise ValueError("No field %s in %s" % (fields[i], file_name))
+                    else:
+                        value = split[positions[i]]
+                        prefix = fields[i] + '='
+                        record.append(value[len(prefix):] if value.startswith(prefix) else value)
+                yield tuple(record)
+            header = line if line.startswith(">") else None
+
+
+def read_trust_fa(file_name, fields=('V', 'J', 'nSeqCDR3', 'aaSeqCDR3')):
+    """
+    Reads TRUST .fa output into DataFrame keeping only requested fields
+
+    Arguments:
+        file_name -- path to the .fa / .fa.gz file
+        fields    -- names of fields to extract (see iter_trust_fa)
+    """
+    return _to_frame(file_name, iter_trust_fa(file_name, fields), fields, 400)
+
+
+def read_trust_txt(file_name, columns=('V', 'J', 'nSeqCDR3', 'aaSeqCDR3')):
+    """
+    Reads TRUST 3 .txt output (plain or gzipped) into DataFrame keeping only
+    requested columns; Vgene, Jgene, cdr3aa and cdr3dna are renamed to
+    V, J, aaSeqCDR3 and nSeqCDR3 respectively
+    """
+    original = dict((v, k) for k, v in TRUST_3_TXT_COLUMNS.items())
+    names = [original.get(c, c) for c in columns]
+    data = pd.read_table(file_name, usecols=names, dtype=str, quoting=3)
+    return data.rename(columns=TRUST_3_TXT_COLUMNS)[list(columns)]
+
+
+def iter_in_silico_fasta(file_name, fields):
+    """
+    Streams header fields of in-silico generated FASTA (plain or gzipped)
+
+    Arguments:
+        file_name -- path to the FASTA file
+        fields    -- names of fields to extract (see IN_SILICO_FIELDS)
+
+    Returns:
+        generator of tuples with requested fields
+    """
+    positions = [IN_SILICO_FIELDS.index(f) for f in fields]
+    with open_text(file_name) as f:
+        for line in f:
+            if not line.startswith('>'):
+                continue
+            split = line.split("|")
+            yield tuple(split[p] for p in positions)
+
+
+def read_in_silico_fasta(file_name, fields=('nSeqCDR3', 'aaSeqCDR3')):
+    """
+    Reads header fields of in-silico generated FASTA into DataFrame
+    """
+    return _to_frame(file_name, iter_in_silico_fasta(file_name, fields), fields, 2000)
@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+"""
+Comparison of RNA-Seq clonotypes with Rep-Seq control samples (answer to
+Hu et al); a Python port of the analysis in answer_to_Hu_et_al/Analysis.ipynb
+
+Instead of scanning each control sample for each clonotype, all
+clonotypes of one chain are matched against a control sample in a single
+pass: with a hash index over control CDR3s for the conventional (exact)
+comparison, and with an Aho-Corasick automaton over clonotype CDR3s for
+the substring search of Hu et al.
+
+Run from the answer_to_Hu_et_al directory (or pass it as an argument):
+
+    python controlComparison.py .
+
+Writes all.results.tsv and false.positives/fp.*.tsv.gz with the same
+columns as the notebook.
+"""
+import argparse
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import stageTrace
+from cdr3Index import SubstringMatcher
+from cloneTables import open_text
+
+# Paths relative to the analysis directory, as in the notebook
+DATA_PATH = 'trust_repo/data/'
+DATA_PATH_TRUST_3 = 'data/trust.3.'
+DATA_PATH_ADAPTIVE = 'data/adaptive_repseq/'
+
+SAMPLES = ['SPX8151-1', 'SPX8151-2', 'SPX6730-1', 'SPX6730-2', 'TCGA-CZ-5985', 'TCGA-CZ-4862', 'TCGA-CZ-5463']
+CONTROLS = ['SPX8151', 'SPX6730', 'TCGA-CZ-5985', 'TCGA-CZ-4862', 'TCGA-CZ-5463']
+SOFTWARE_TYPES = ['MiXCR', 'TRUST.2.1', 'TRUST.2.1+post', 'TRUST.3.TCGA', 'TRUST.3.Tophat']
+COMPARISON_METHODS = ['Exact', 'Hu_et_al']
+CHAINS = ['TRB', 'TRA']
+
+RESULT_COLUMNS = ['sample.name', 'chain', 'software.name', 'comparison.method.name',
+                  'number.of.clonotypes', 'number.of.canonical.clonotypes',
+                  'intersection.with.control.sample', 'unexpected.intersection.with.non.control.samples',
+                  'conflicting.amino.acid.matches', 'several.different.matches.in.one.of.the.control.samples']
+
+CANONICAL = '^C[^_]*[FW]$'
+TRUST_2_1_COLUMNS = ['filename', 'est_clonal_freq', 'seq_length', 'est_lib_size', 'vgene', 'jgene',
+                     'reportgene', 'cdr3aa', 'minus_log_Eval', 'cdr3dna', 'totaldna']
+# Number of lines skipped at the beginning of TRUST 2.1 .fa files
+TRUST_2_1_SKIP = 12
+
+NO_MATCHES = np.zeros(0, dtype=np.int64)
+
+
+def get_control_name(sample_name):
+    """
+    Name of the control sample for an RNA-Seq sample
+    """
+    if sample_name.startswith('TCGA-'):
+        return sample_name
+    return sample_name[:-2] if sample_name[-2:] in ('-1', '-2') else sample_name
+
+
+def is_control_of(sample_name, control_name):
+    return get_control_name(sample_name) == control_name
+
+
+def _r_types(table):
+    """
+    Mimics column type conversion of R read.delim for a table read as
+    strings: empty values of integer and of completely empty columns become
+    NA, integers are normalised
+    """
+    for c in table.columns:
+        values = table[c]
+        present = values.notnull() & (values != '')
+        if not present.any():
+            table[c] = None
+        elif values[present].str.fullmatch('-?[0-9]+').all():
+            table[c] = values.where(present, None).map(lambda v: str(int(v)) if v is not None else None)
+    return table
+
+
+def read_r_table(file_name, **kwargs):
+    """
+    Reads a tab separated (possibly gzipped) table as read.delim2(quote = "") would
+    """
+    table = pd.read_table(file_name, dtype=str, quoting=3, keep_default_na=False, na_values=['NA'], **kwargs)
+    return _r_types(table.astype(object).where(table.notnull(), None))
+
+
+def _is_canonical(cdr3aa):
+    return cdr3aa.str.contains(CANONICAL).fillna(False).astype(bool)
+
+
+def _chain_type(genes, default):
+    chain = pd.Series(default, index=genes.index, dtype=object)
+    for c in ['TRA', 'TRB', 'TRD', 'TRG']:
+        chain[genes.str.contains(c, regex=False)] = c
+    return chain
+
+
+def _r_substr(x, start, stop):
+    if x is None or np.isnan(start) or np.isnan(stop):
+        return None
+    start, stop = max(int(start), 1), min(int(stop), len(x))
+    return x[start - 1:stop] if stop >= start else ''
+
+
+def read_control(control_name, chain, directory='.'):
+    """
+    Rep-Seq control sample
+
+    Returns:
+        DataFrame with columns:
+            nucleotide -- target sequence for the substring search of Hu et al
+            cdr3dna    -- CDR3 nucleotide sequence
+            cdr3aa     -- CDR3 amino acid sequence
+    """
+    if control_name.startswith('SPX'):
+        file_name = os.path.join(directory, DATA_PATH, 'Rep_TCRseq',
+                                 '%s.%s.txt.gz' % (get_control_name(control_name), 'TRB' if chain == 'TRB' else 'TRA'))
+        control = read_r_table(file_name, usecols=['nSeqCDR3', 'aaSeqCDR3'])
+        return pd.DataFrame({'nucleotide': control.nSeqCDR3.values,
+                             'cdr3dna': control.nSeqCDR3.values,
+                             'cdr3aa': control.aaSeqCDR3.values})
+
+    # Adaptive data does not depend on the chain
+    file_name = os.path.join(directory, DATA_PATH_ADAPTIVE, control_name + '.tsv.gz')
+    control = read_r_table(file_name, usecols=['nucleotide', 'aminoAcid', 'cdr3Length', 'vIndex'])
+    control = control[~control.aminoAcid.duplicated()]
+    v_index = pd.to_numeric(control.vIndex).values.astype(np.float64)
+    cdr3_length = pd.to_numeric(control.cdr3Length).values.astype(np.float64)
+    return pd.DataFrame({'nucleotide': control.nucleotide.values,
+                         'cdr3dna': [_r_substr(x, v + 1, v + l)
+                                     for x, v, l in zip(control.nucleotide.values, v_index, cdr3_length)],
+                         'cdr3aa': control.aminoAcid.values})
+
+
+def read_controls(chains=CHAINS, controls=CONTROLS, directory='.'):
+    """
+    All control samples for each chain
+
+    Returns:
+        dict chain -> OrderedDict control name -> control DataFrame (see
+        read_control); chain independent controls are shared between chains
+    """
+    shared = {}
+    result = {}
+    for chain in chains:
+        result[chain] = OrderedDict()
+        for name in controls:
+            if name.startswith('SPX'):
+                result[chain][name] = read_control(name, chain, directory)
+            else:
+                if name not in shared:
+                    shared[name] = read_control(name, chain, directory)
+                result[chain][name] = shared[name]
+    return result
+
+
+def read_mixcr(sample, chain='TRB', directory='.'):
+    name = 'RNASeq_%s_cut100_paired_extended_rescued2.clns.TCR' % sample if sample.startswith('SPX') else sample
+    mixcr = read_r_table(os.path.join(directory, DATA_PATH, 'Rep_MiXCR', name + '.txt'))
+    genes = mixcr.allVHitsWithScore.fillna('NA') + ' ' + mixcr.allJHitsWithScore.fillna('NA')
+    mixcr = mixcr[genes.str.contains(chain)].reset_index(drop=True)
+    mixcr['cdr3dna'] = mixcr.nSeqCDR3
+    mixcr['cdr3aa'] = mixcr.aaSeqCDR3
+    mixcr['canonical'] = _is_canonical(mixcr.cdr3aa)
+    return mixcr
+
+
+def read_trust_2_1(sample, chain='TRB', with_post_processing=False, directory='.'):
+    file_name = os.path.join(directory, DATA_PATH, 'Rep_TRUST', sample + ('.fa.txt' if with_post_processing else '.fa'))
+    with open_text(file_name) as f:
+        lines = [line.rstrip('\r\n') for line in f][TRUST_2_1_SKIP:]
+    lines = [line for line in lines if line]
+    fields = len(TRUST_2_1_COLUMNS) - 1
+    records = [(header.split('+') + [None] * fields)[:fields] + [sequence.split('+')[0]]
+               for header, sequence in zip(lines[0::2], lines[1::2])]
+    trust = _r_types(pd.DataFrame(records, columns=TRUST_2_1_COLUMNS, dtype=object))
+    trust['cdr3type'] = _chain_type(trust.vgene.fillna('NA') + trust.jgene.fillna('NA'), '0')
+    trust = trust[trust.cdr3type == chain]
+    trust = trust[~trust.cdr3dna.duplicated()].reset_index(drop=True)
+    trust['canonical'] = _is_canonical(trust.cdr3aa)
+    return trust
+
+
+def read_trust_3(sample, chain='TRB', tcga_bam=True, directory='.'):
+    file_name = os.path.join(directory, DATA_PATH_TRUST_3 + ('TCGA.bam' if tcga_bam else 'tophat.bam'), sample + '.txt.gz')
+    trust = read_r_table(file_name)
+    trust['type'] = _chain_type(trust.Vgene.fillna('NA') + trust.Jgene.fillna('NA'), '')
+    trust = trust[trust.type == chain].reset_index(drop=True)
+    trust['canonical'] = _is_canonical(trust.cdr3aa)
+    return trust
+
+
+def read_rnaseq(sample, software, chain='TRB', directory='.'):
+    """
+    RNA-Seq analysis results (with 'cdr3dna', 'cdr3aa' and 'canonical'
+    columns) of given software for a sample
+    """
+    if software == 'MiXCR':
+        return read_mixcr(sample, chain, directory)
+    elif software == 'TRUST.2.1':
+        return read_trust_2_1(sample, chain, False, directory)
+    elif software == 'TRUST.2.1+post':
+        return read_trust_2_1(sample, chain, True, directory)
+    elif software == 'TRUST.3.TCGA':
+        return read_trust_3(sample, chain, True, directory)
+    elif software == 'TRUST.3.Tophat':
+        return read_trust_3(sample, chain, False, directory)
+    raise ValueError('Unknown software: %s' % software)
+
+
+def match_exact(control, queries):
+    """
+    Conventional comparison: rows of control with cdr3dna equal to the query
+
+    Returns:
+        dict query -> int array of matched control rows
+    """
+    index = control.groupby('cdr3dna', sort=False).indices
+    return dict((q, index[q]) for q in queries if q in index)
+
+
+def match_substring(control, queries):
+    """
+    Method of Hu et al: rows of control with the query being a substring of
+    the 'nucleotide' sequence
+
+    Returns:
+        dict query -> int array of matched control rows
+    """
+    patterns = [q for q in queries if isinstance(q, str) and q != '']
+    hits = SubstringMatcher(patterns).search(control.nucleotide.values)
+    return dict((q, h) for q, h in zip(patterns, hits) if len(h))
+
+
+MATCH_FUNCTIONS = {'Exact': match_exact, 'Hu_et_al': match_substring}
+
+
+def match_controls(controls, queries, method):
+    """
+    Matches all queries against each control sample in one pass per control
+
+    Arguments:
+        controls -- OrderedDict control name -> control DataFrame
+        queries  -- iterable of CDR3 nucleotide sequences
+        method   -- comparison method (see COMPARISON_METHODS)
+
+    Returns:
+        dict control name -> dict query -> int array of matched control rows
+    """
+    queries = set(q for q in queries if q is not None)
+    done = {}
+    result = {}
+    for name, control in controls.items():
+        # controls shared between chains are matched once
+        if id(control) not in done:
+            done[id(control)] = MATCH_FUNCTIONS[method](control, queries)
+        result[name] = done[id(control)]
+    return result
+
+
+class SampleIndex:
+    """
+    Inverted index of sequences: sequence -> bitset (int) of samples
+    containing it
+
+    Samples are added in a single streaming pass, adding a sample does not
+    touch the already indexed ones.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.bits = {}
+        self.masks = {}
+
+    def add(self, name, sequences):
+        """
+        Adds a sample
+
+        Arguments:
+            name      -- sample name
+            sequences -- iterable of sequences
+        """
+        bit = 1 << len(self.names)
+        self.names.append(name)
+        self.bits[name] = bit
+        masks = self.masks
+        for s in set(sequences):
+            masks[s] = masks.get(s, 0) | bit
+
+    def mask(self, sequence):
+        return self.masks.get(sequence, 0)
+
+    def intersections(self, names=None):
+        """
+        Sequences shared by each pair of samples, computed in one pass over
+        distinct sequences
+
+        Returns:
+            dict (name, name) -> set of sequences present in both samples
+            (both orders of each pair)
+        """
+        names = self.names if names is None else list(names)
+        bits = [(name, self.bits[name]) for name in names]
+        selected = 0
+        for _, bit in bits:
+            selected |= bit
+        result = dict(((name_i, name_j), set()) for name_i in names for name_j in names if name_i != name_j)
+        for sequence, mask in self.masks.items():
+            mask &= selected
+            # less than two samples
+            if mask & (mask - 1) == 0:
+                continue
+            present = [name for name, bit in bits if mask & bit]
+            for i, name_i in enumerate(present):
+                for name_j in present[i + 1:]:
+                    result[(name_i, name_j)].add(sequence)
+                    result[(name_j, name_i)].add(sequence)
+        return result
+
+
+class ControlIndex:
+    """
+    Inverted index of CDR3 amino acid sequences of control samples, and
+    expected intersections of control pairs
+    """
+
+    def __init__(self, controls):
+        """
+        Arguments:
+            controls -- OrderedDict control name -> control DataFrame (see read_control)
+        """
+        self.aa = SampleIndex()
+        for name, control in controls.items():
+            self.aa.add(name, control.cdr3aa.values)
+        self.common_aa = self.aa.intersections()
+        for pair in self.common_aa:
+            self.common_aa[pair].discard('')
+
+    def count_unexpected(self, sequences, control_i, control_j):
+        """
+        Number of distinct amino acid sequences matched in control_j that
+        are not in its expected intersection with control_i; if the controls
+        have no common sequences, '' is expected as in the notebook
+        """
+        if (control_i, control_j) not in self.common_aa:
+            return len(set(sequences))
+        pair = self.aa.bits[control_i] | self.aa.bits[control_j]
+        empty_expected = not self.common_aa[(control_i, control_j)]
+        return sum(1 for s in set(sequences)
+                   if not (empty_expected if s == '' else self.aa.mask(s) & pair == pair))
+
+
+def _object_column(values):
+    column = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        column[i] = v
+    return column
+
+
+def _no_common_elements(a1, a2):
+    """
+    True for two non-empty lists having no common elements (and no repeated
+    elements, as in the notebook)
+    """
+    return len(a1) != 0 and len(a2) != 0 and len(set(a1 + a2)) == len(a1) + len(a2)
+
+
+def compare_with_controls(sample, dataset, controls, matches, index):
+    """
+    Compares RNA-Seq clonotypes with all control samples
+
+    Arguments:
+        sample   -- RNA-Seq sample name
+        dataset  -- RNA-Seq analysis results (see read_rnaseq)
+        controls -- OrderedDict control name -> control DataFrame
+        matches  -- matches of dataset CDR3s in the controls (see match_controls)
+        index    -- ControlIndex of the controls
+
+    Returns:
+        dataset with mapped.times_*, mapped.aa.seqs_*, empty.aa.intersection.detected,
+        several.matches and mapped.not.expected_* columns
+    """
+    comparison = dataset.copy()
+    queries = dataset.cdr3dna.values
+    aa = OrderedDict()
+    for name, control in controls.items():
+        control_aa = control.cdr3aa.values
+        rows = [matches[name].get(q, NO_MATCHES) for q in queries]
+        aa[name] = [list(control_aa[r]) for r in rows]
+        comparison['mapped.times_' + name] = np.array([len(r) for r in rows], dtype=np.int64)
+        comparison['mapped.aa.seqs_' + name] = _object_column(aa[name])
+
+    names = list(controls)
+    pairs = [(name_i, name_j) for i, name_i in enumerate(names) for name_j in names[i + 1:]]
+    comparison['empty.aa.intersection.detected'] = [
+        any(_no_common_elements(aa[name_i][k], aa[name_j][k]) for name_i, name_j in pairs)
+        for k in range(len(comparison))]
+    comparison['several.matches'] = [any(len(set(aa[name][k])) > 1 for name in names) for k in range(len(comparison))]
+
+    for name in names:
+        if not is_control_of(sample, name):
+            control = get_control_name(sample)
+            comparison['mapped.not.expected_' + name] = np.array(
+                [index.count_unexpected(a, control, name) for a in aa[name]], dtype=np.int64)
+    return comparison
+
+
+def summarize(sample, chain, software, method, comparison):
+    """
+    Record of all.results.tsv for a comparison (see compare_with_controls)
+    """
+    result = OrderedDict(zip(RESULT_COLUMNS, [sample, chain, software, method, 0, 0, 0, 0, 0, 0]))
+    if comparison is None or len(comparison) == 0:
+        return result
+    control_columns = [c for c in comparison.columns
+                       if c.startswith('mapped.times_') and is_control_of(sample, c[len('mapped.times_'):])]
+    non_control_columns = [c for c in comparison.columns if c.startswith('mapped.not.expected_')]
+    result['number.of.clonotypes'] = len(comparison)
+    result['number.of.canonical.clonotypes'] = int(comparison.canonical.sum())
+    result['intersection.with.control.sample'] = int((comparison[control_columns].values > 0).sum())
+    result['unexpected.intersection.with.non.control.samples'] = int((comparison[non_control_columns].values > 0)
+                                                                     .any(axis=1).sum())
+    result['conflicting.amino.acid.matches'] = int(comparison['empty.aa.intersection.detected'].sum())
+    result['several.different.matches.in.one.of.the.control.samples'] = int(comparison['several.matches'].sum())
+    return result
+
+
+def false_positives(comparison):
+    """
+    Clonotypes with conflicting or several different matches, formatted as
+    the notebook's false.positives/fp.*.tsv files
+    """
+    fp = comparison[comparison['several.matches'] | comparison['empty.aa.intersection.detected']].copy()
+    for c in [c for c in fp.columns if c.startswith('mapped.aa.seqs_')]:
+        if len(fp) == 0:
+            # R drops list columns of empty tables
+            del fp[c]
+        else:
+            fp[c] = [','.join('NA' if s is None else s for s in seqs) for seqs in fp[c]]
+    for c in fp.columns:
+        if fp[c].dtype == bool:
+            fp[c] = np.where(fp[c], 'TRUE', 'FALSE')
+    return fp
+
+
+def write_false_positives(fp, file_name):
+    fp.to_csv(file_name, sep='\t', index=False, na_rep='NA', quoting=3)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares RNA-Seq clonotypes with Rep-Seq control samples')
+    parser.add_argument('directory', nargs='?', default='.', help='answer_to_Hu_et_al directory (default: current)')
+    parser.add_argument('--output', default='all.results.tsv', help='summary table (default: %(default)s)')
+    parser.add_argument('--false-positives', default='false.positives',
+                        help='directory for fp.*.tsv.gz tables (default: %(default)s)')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='append per-stage timing and memory records to FILE (see stageTrace.py)')
+    args = parser.parse_args()
+    if args.trace:
+        stageTrace.configure(args.trace)
+
+    def path(name):
+        return os.path.join(args.directory, name)
+
+    with stageTrace.stage('readControls'):
+        controls = read_controls(directory=args.directory)
+    with stageTrace.stage('indexControls'):
+        indices = dict((chain, ControlIndex(controls[chain])) for chain in CHAINS)
+
+    datasets = OrderedDict()
+    with stageTrace.stage('readDatasets') as stage:
+        for sample in SAMPLES:
+            for software in SOFTWARE_TYPES:
+                if software == 'TRUST.3.TCGA' and sample.startswith('SPX'):
+                    continue
+                for chain in CHAINS:
+                    datasets[(sample, software, chain)] = read_rnaseq(sample, software, chain, args.directory)
+                    stage.add_rows(len(datasets[(sample, software, chain)]))
+
+    matches = {}
+    for chain in CHAINS:
+        queries = set(q for (_, _, c), d in datasets.items() if c == chain for q in d.cdr3dna.values)
+        for method in COMPARISON_METHODS:
+            with stageTrace.stage('matchControls', chain=chain, method=method) as stage:
+                matches[(chain, method)] = match_controls(controls[chain], queries, method)
+                stage.add_rows(len(queries))
+
+    if not os.path.exists(path(args.false_positives)):
+        os.makedirs(path(args.false_positives))
+    results = []
+    for sample in SAMPLES:
+        print('Sample: %s' % sample)
+        for software in SOFTWARE_TYPES:
+            for method in COMPARISON_METHODS:
+                for chain in CHAINS:
+                    if (sample, software, chain) not in datasets:
+                        continue
+                    dataset = datasets[(sample, software, chain)]
+                    comparison = None
+                    if len(dataset) > 0:
+                        with stageTrace.stage('compareWithControls', sample=sample, software=software,
+                                              method=method, chain=chain) as stage:
+                            comparison = compare_with_controls(sample, dataset, controls[chain],
+                                                               matches[(chain, method)], indices[chain])
+                            write_false_positives(false_positives(comparison), path(os.path.join(
+                                args.false_positives, '.'.join(['fp', sample, software, method, chain, 'tsv.gz']))))
+                            stage.add_rows(len(dataset))
+                    results.append(summarize(sample, chain, software, method, comparison))
+
+    pd.DataFrame(results, columns=RESULT_COLUMNS).to_csv(path(args.output), sep='\t', index=False)
@@ -1,23 +1,60 @@
 #!/usr/bin/env python
-import numpy as np
 import pandas as pd
-import re
-import json
-import sys
+import argparse
 
-inputFile = sys.argv[1]
+import stageTrace
+from resultsStore import readResults, PARAMETERS
 
-rx="clones(?P<clones>[0-9]+)_coverage(?P<coverage>[0-9]+)_length(?P<length>[0-9]+)_seq(?P<_sequencer>[^_]+)"
-results = pd.read_json(inputFile, lines=True)
-columns_to_convert=["clones", "coverage", "length"]
-results = pd.concat([results, results.inputFile.str.extract(rx, expand=True)], axis=1)
-results[columns_to_convert] = results[columns_to_convert].apply(pd.to_numeric)
-results["percentBad"] = results.overlapsProducingNewCDR3 / results.totalOverlaps
-results["percentBadDiversity"] = results.newCDR3Diversity / results.clonesTotal
-results["percentBadDiversityHQ"] = results.hqNewCDR3Diversity / results.clonesTotal
-print("Bad overlaps in 10^2 and 10^3: %.3f%%" % (100.0 * results.loc[results.clones <= 1000, "percentBad"].max()))
-print("Bad overlap diversity in 10^2 and 10^3: %.3f%%" % (100.0 * results.loc[results.clones <= 1000, "percentBadDiversity"].max()))
-print("Bad overlap high quality diversity in 10^2 and 10^3: %.3f%%" % (100.0 * results.loc[results.clones <= 1000, "percentBadDiversityHQ"].max()))
-print("Bad overlaps: %.3f%%" % (100.0 * results.percentBad.max()))
-print("Bad overlaps diversity: %.3f%%" % (100.0 * results.percentBadDiversity.max()))
-print("Bad overlaps high quality diversity: %.3f%%" % (100.0 * results.percentBadDiversityHQ.max()))
\ No newline at end of file
+parser = argparse.ArgumentParser(description="Prints overall false overlap statistics")
+parser.add_argument("inputFile", help="results store of falsePositivesBatch.py or JSONL results")
+parser.add_argument("--by", action="append", default=[], choices=PARAMETERS,
+                    help="aggregate quality sweep curves separately for each value of a simulation parameter (may be repeated)")
+parser.add_argument("--curves", metavar="FILE", help="write quality sweep curves of all datasets to FILE (TSV)")
+args = parser.parse_args()
+inputFile = args.inputFile
+
+with stageTrace.stage("readResults", inputFile=inputFile) as stage:
+    results = readResults(inputFile, "overlaps")
+    stage.add_rows(len(results))
+
+with stageTrace.stage("aggregate"):
+    results["percentBad"] = results.overlapsProducingNewCDR3 / results.totalOverlaps
+    results["percentBadDiversity"] = results.newCDR3Diversity / results.clonesTotal
+    results["percentBadDiversityHQ"] = results.hqNewCDR3Diversity / results.clonesTotal
+    print("Bad overlaps in 10^2 and 10^3: %.3f%%" % (100.0 * results.loc[results.clones <= 1000, "percentBad"].max()))
+    print("Bad overlap diversity in 10^2 and 10^3: %.3f%%" % (100.0 * results.loc[results.clones <= 1000, "percentBadDiversity"].max()))
+    print("Bad overlap high quality diversity in 10^2 and 10^3: %.3f%%" % (100.0 * results.loc[results.clones <= 1000, "percentBadDiversityHQ"].max()))
+    print("Bad overlaps: %.3f%%" % (100.0 * results.percentBad.max()))
+    print("Bad overlaps diversity: %.3f%%" % (100.0 * results.percentBadDiversity.max()))
+    print("Bad overlaps high quality diversity: %.3f%%" % (100.0 * results.percentBadDiversityHQ.max()))
+
+# results of getFalseOverlaps.py --quality-sweep
+if "qualitySweep" in results.columns and results.qualitySweep.notnull().any():
+    with stageTrace.stage("aggregateQualitySweep") as stage:
+        swept = results[results.qualitySweep.notnull()]
+        curves = []
+        for sweep, dataset in zip(swept.qualitySweep, swept[PARAMETERS + ["clonesTotal"]].to_dict("records")):
+            curve = pd.DataFrame(sweep)
+            for key, value in dataset.items():
+                curve[key] = value
+            curves.append(curve)
+        curves = pd.concat(curves, ignore_index=True)
+        curves["percentBad"] = curves.overlapsProducingNewCDR3 / curves.overlaps
+        curves["percentBadDiversity"] = curves.newCDR3Diversity / curves.clonesTotal
+        stage.add_rows(len(curves))
+
+        # pooled and worst-case rates over the clones/coverage/length/sequencer grid at each threshold
+        grouped = curves.groupby(args.by + ["thresholds"])
+        summary = grouped.agg(datasets=("overlaps", "size"), overlaps=("overlaps", "sum"),
+                              badOverlaps=("overlapsProducingNewCDR3", "sum"),
+                              maxPercentBad=("percentBad", "max"), maxPercentBadDiversity=("percentBadDiversity", "max"))
+        summary.insert(3, "percentBad", summary.badOverlaps / summary.overlaps)
+        for column in ["percentBad", "maxPercentBad", "maxPercentBadDiversity"]:
+            summary[column] = 100.0 * summary[column]
+        summary = summary.reset_index().rename(columns={"thresholds": "minQualCDR3"})
+        print("")
+        print("Bad overlaps (%) by minimal CDR3 quality:")
+        print(summary.to_string(index=False, float_format=lambda v: "%.3f" % v))
+
+        if args.curves:
+            curves.rename(columns={"thresholds": "minQualCDR3"}).to_csv(args.curves, sep="\t", index=False)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+Partitioned columnar store of the Hu et al. false-positive tables
+
+compact() converts answer_to_Hu_et_al/false.positives/fp.*.tsv.gz into one
+dataset partitioned by sample/software/method/chain:
+
+    <store>/manifest.json
+    <store>/dictionaries/<column>.data.npy        UTF-8 bytes of sorted distinct values of a string column
+    <store>/dictionaries/<column>.offsets.npy     offsets of the values in data
+    <store>/<sample>/<software>/<method>/<chain>/<column>.npy
+
+Numeric and logical columns are stored as plain arrays; string columns
+(CDR3 sequences, gene hits, matched sequences, ...) are dictionary encoded:
+partitions hold int32 codes into a dictionary shared by all partitions
+(-1 for NA). FalsePositiveTables reads only the requested partitions and
+columns, evaluates equality filters on the codes and decodes partitions in
+parallel threads:
+
+    tables = FalsePositiveTables('answer_to_Hu_et_al/false.positives.store')
+    tables.read(columns=['cdr3aa', 'canonical'], where={'canonical': True}, chain='TRB')
+
+    python falsePositiveTables.py compact answer_to_Hu_et_al/false.positives store
+    python falsePositiveTables.py summary store
+"""
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Increment when the layout of the store changes
+STORE_VERSION = 1
+PARTITION_KEYS = ['sample', 'software', 'method', 'chain']
+# fp.<sample>.<software>.<method>.<chain>.tsv.gz; sample names contain no dots
+FILE_RX = re.compile(r'^fp\.(?P<sample>[^.]+)\.(?P<software>.+)\.(?P<method>[^.]+)\.(?P<chain>[^.]+)\.tsv\.gz$')
+# Kinds of stored columns
+DICTIONARY = 'dictionary'
+PLAIN_KINDS = ['int64', 'float64', 'bool']
+
+
+def _fingerprint(file_name):
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _column_kind(values):
+    kind = str(values.dtype)
+    return kind if kind in PLAIN_KINDS else DICTIONARY
+
+
+def _read_source(file_name):
+    """
+    Reads a fp.*.tsv.gz table; executed in worker processes
+
+    Returns:
+        (partition dict, DataFrame)
+    """
+    match = FILE_RX.match(os.path.basename(file_name))
+    partition = OrderedDict((key, match.group(key)) for key in PARTITION_KEYS)
+    partition['source'] = os.path.basename(file_name)
+    partition['fingerprint'] = _fingerprint(file_name)
+    return partition, pd.read_csv(file_name, sep='\t', low_memory=False)
+
+
+def _save(file_name, values):
+    tmp_name = '%s.tmp%s' % (file_name, os.getpid())
+    with open(tmp_name, 'wb') as f:
+        np.save(f, values, allow_pickle=False)
+    os.rename(tmp_name, file_name)
+
+
+def _save_dictionary(directory, column, values):
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    _save(os.path.join(directory, column + '.data.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    _save(os.path.join(directory, column + '.offsets.npy'), offsets)
+
+
+def _load_dictionary(directory, column):
+    data = np.load(os.path.join(directory, column + '.data.npy')).tobytes()
+    offsets = np.load(os.path.join(directory, column + '.offsets.npy'))
+    return pd.Index([data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)], dtype=object)
+
+
+def compact(source_directory, store_directory, processes=None):
+    """
+    Converts fp.*.tsv.gz tables into a partitioned columnar store; the
+    manifest of an existing store in store_directory is replaced
+
+    Returns:
+        number of partitions
+    """
+    files = sorted(f for f in glob.glob(os.path.join(source_directory, 'fp.*.tsv.gz'))
+                   if FILE_RX.match(os.path.basename(f)))
+    pool = multiprocessing.Pool(max(1, min(processes or multiprocessing.cpu_count(), len(files))))
+    tables = pool.map(_read_source, files)
+    pool.close()
+    pool.join()
+
+    # shared dictionaries of all string columns
+    strings = {}
+    for _, table in tables:
+        for c in table.columns:
+            if _column_kind(table[c]) == DICTIONARY:
+                strings.setdefault(c, set()).update(str(v) for v in table[c].dropna())
+    dictionaries = dict((c, sorted(values)) for c, values in strings.items())
+
+    manifest = OrderedDict([('version', STORE_VERSION), ('partition_keys', PARTITION_KEYS),
+                            ('dictionaries', sorted(dictionaries)), ('partitions', [])])
+    os.makedirs(os.path.join(store_directory, 'dictionaries'), exist_ok=True)
+    for c, values in dictionaries.items():
+        _save_dictionary(os.path.join(store_directory, 'dictionaries'), c, values)
+        dictionaries[c] = dict((v, i) for i, v in enumerate(values))
+    for partition, table in tables:
+        path = os.path.join(*[partition[key] for key in PARTITION_KEYS])
+        os.makedirs(os.path.join(store_directory, path), exist_ok=True)
+        columns = []
+        for c in table.columns:
+            kind = _column_kind(table[c])
+            if kind == DICTIONARY:
+                present = table[c].notnull().values
+                values = np.full(len(table), -1, dtype=np.int32)
+                values[present] = [dictionaries[c][str(v)] for v in table[c].values[present]]
+            else:
+                values = table[c].values.astype(kind)
+            _save(os.path.join(store_directory, path, c + '.npy'), values)
+            columns.append([c, kind])
+        partition['path'] = path
+        partition['rows'] = len(table)
+        partition['columns'] = columns
+        manifest['partitions'].append(partition)
+
+    tmp_name = os.path.join(store_directory, 'manifest.json.tmp%s' % os.getpid())
+    with open(tmp_name, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.rename(tmp_name, os.path.join(store_directory, 'manifest.json'))
+    return len(tables)
+
+
+def _selected(value, condition):
+    if isinstance(condition, (list, tuple, set, frozenset)):
+        return value in condition
+    return value == condition
+
+
+class FalsePositiveTables:
+    """
+    Query interface of a store written by compact()
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if self.manifest['version'] != STORE_VERSION:
+            raise ValueError('%s: unsupported store version %s' % (directory, self.manifest['version']))
+        self.dictionaries = {}
+
+    def dictionary(self, column):
+        """
+        Sorted distinct values of a string column (loaded on first use)
+        """
+        if column not in self.dictionaries:
+            self.dictionaries[column] = _load_dictionary(os.path.join(self.directory, 'dictionaries'), column)
+        return self.dictionaries[column]
+
+    def partitions(self, **filters):
+        """
+        Manifest entries of partitions matching filters, e.g.
+        partitions(software='MiXCR', chain=['TRA', 'TRB'])
+        """
+        unknown = set(filters) - set(PARTITION_KEYS)
+        if unknown:
+            raise ValueError('unknown partition keys: %s' % ', '.join(sorted(unknown)))
+        return [p for p in self.manifest['partitions']
+                if all(_selected(p[key], condition) for key, condition in filters.items())]
+
+    def columns(self, **filters):
+        """
+        Names of columns present in any of the selected partitions
+        """
+        names = OrderedDict()
+        for p in self.partitions(**filters):
+            for c, _ in p['columns']:
+                names[c] = True
+        return list(names)
+
+    def _mask(self, partition, kinds, where):
+        """
+        Rows of a partition satisfying equality filters, evaluated on stored
+        values (codes for dictionary columns)
+        """
+        mask = np.ones(partition['rows'], dtype=bool)
+        for c, condition in where.items():
+            if c not in kinds:
+                mask[:] = False
+                continue
+            values = np.load(os.path.join(self.directory, partition['path'], c + '.npy'))
+            wanted = list(condition) if isinstance(condition, (list, tuple, set, frozenset)) else [condition]
+            if kinds[c] == DICTIONARY:
+                codes = self.dictionary(c).get_indexer([str(v) for v in wanted if v is not None])
+                mask &= np.isin(values, codes[codes >= 0])
+            else:
+                mask &= np.isin(values, wanted)
+        return mask
+
+    def _decode(self, partition, columns, where, categorical):
+        kinds = dict(partition['columns'])
+        mask = self._mask(partition, kinds, where) if where else None
+        frame = OrderedDict()
+        for c in columns:
+            if c not in kinds:
+                continue
+            values = np.load(os.path.join(self.directory, partition['path'], c + '.npy'))
+            if mask is not None:
+                values = values[mask]
+            if kinds[c] == DICTIONARY:
+                values = pd.Categorical.from_codes(values, self.dictionary(c))
+                if not categorical:
+                    values = np.asarray(values, dtype=object)
+            frame[c] = values
+        frame = pd.DataFrame(frame, index=pd.RangeIndex(partition['rows'] if mask is None else int(mask.sum())))
+        for i, key in enumerate(PARTITION_KEYS):
+            frame.insert(i, key, partition[key])
+        return frame
+
+    def map_partitions(self, func, columns=None, where=None, threads=None, categorical=False, **filters):
+        """
+        Applies func to each selected partition in parallel threads
+
+        Arguments:
+            func        -- function of a DataFrame (partition keys and the
+                           requested columns of the partition)
+            columns     -- columns to read (default: all columns of the partition)
+            where       -- dict column -> value or list of values; only rows
+                           with these values are read
+            threads     -- number of threads (default: number of CPUs)
+            categorical -- return dictionary columns as pandas categoricals
+            filters     -- partition filters (see partitions)
+
+        Returns:
+            list of (partition manifest entry, func result)
+        """
+        partitions = self.partitions(**filters)
+        # dictionaries are shared, load them once before starting threads
+        for p in partitions:
+            for c, kind in p['columns']:
+                if kind == DICTIONARY and (columns is None or c in columns or c in (where or {})):
+                    self.dictionary(c)
+
+        def task(partition):
+            wanted = [c for c, _ in partition['columns']] if columns is None else columns
+            return partition, func(self._decode(partition, wanted, where, categorical))
+
+        with ThreadPoolExecutor(max_workers=threads or multiprocessing.cpu_count()) as executor:
+            return list(executor.map(task, partitions))
+
+    def read(self, columns=None, where=None, threads=None, categorical=False, **filters):
+        """
+        Rows of the selected partitions as one DataFrame (see map_partitions);
+        columns missing in some partitions are NA there
+        """
+        frames = [frame for _, frame in self.map_partitions(lambda frame: frame, columns, where, threads,
+                                                              categorical, **filters)]
+        if not frames:
+            return pd.DataFrame(columns=PARTITION_KEYS + list(columns or []))
+        return pd.concat(frames, ignore_index=True, sort=False)
+
+    def read_partition(self, sample, software, method, chain, columns=None):
+        """
+        A single table as read from its fp.*.tsv.gz file
+        """
+        partitions = self.partitions(sample=sample, software=software, method=method, chain=chain)
+        if not partitions:
+            raise KeyError((sample, software, method, chain))
+        partition = partitions[0]
+        frame = self._decode(partition, [c for c, _ in partition['columns']] if columns is None else columns,
+                             None, False)
+        return frame.drop(columns=PARTITION_KEYS)
+
+    def summary(self, threads=None, **filters):
+        """
+        False positive counts of all.results.tsv for each partition: conflicting
+        amino acid matches and several different matches in a control sample
+        """
+        def count(frame):
+            return len(frame), int(frame['empty.aa.intersection.detected'].sum()), int(frame['several.matches'].sum())
+        columns = ['empty.aa.intersection.detected', 'several.matches']
+        records = []
+        for p, (rows, conflicting, several) in self.map_partitions(count, columns, threads=threads, **filters):
+            records.append(OrderedDict([('sample.name', p['sample']), ('chain', p['chain']),
+                                        ('software.name', p['software']), ('comparison.method.name', p['method']),
+                                        ('false.positives', rows), ('conflicting.amino.acid.matches', conflicting),
+                                        ('several.different.matches.in.one.of.the.control.samples', several)]))
+        return pd.DataFrame.from_records(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Columnar store of the Hu et al. false-positive tables')
+    commands = parser.add_subparsers(dest='command', required=True)
+    compact_parser = commands.add_parser('compact', help='convert fp.*.tsv.gz tables into a store')
+    compact_parser.add_argument('source', help='directory with fp.*.tsv.gz tables (false.positives)')
+    compact_parser.add_argument('store', help='output store directory')
+    compact_parser.add_argument('-j', '--jobs', type=int, help='number of worker processes (default: number of CPUs)')
+    summary_parser = commands.add_parser('summary', help='print false positive counts per partition')
+    summary_parser.add_argument('store', help='store directory')
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        print('%s partitions written to %s' % (compact(args.source, args.store, args.jobs), args.store))
+    else:
+        FalsePositiveTables(args.store).summary().to_csv(sys.stdout, sep='\t', index=False)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Runs false overlap and false extension analysis for all simulated
+datasets (fpEstimation_* prefixes) in a single Python process pool
+
+Results are kept in a results store (see resultsStore.py), so only new
+datasets and datasets with changed inputs are analysed on later runs.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+
+import stageTrace
+from mixcrReports import readClonesTotal
+from resultsStore import ResultsStore, ANALYSES
+from getFalseOverlaps import analyzeOverlaps, parseThresholds, CHUNK_SIZE, VERSION as OVERLAPS_VERSION
+from getFalseExtensions import countFalseExtensionsInFile, VERSION as EXTENSIONS_VERSION
+
+
+def findPrefixes(directory):
+    """
+    Prefixes of all simulated datasets in directory, e.g.
+    fpEstimation_clones100_coverage10000_length50_seqHS20
+    """
+    suffix = "_overlaps.txt"
+    return sorted(os.path.normpath(f[:-len(suffix)]) for f in glob.glob(os.path.join(directory, "fpEstimation_*" + suffix)))
+
+
+def inputFiles(prefix):
+    """
+    Input files of both analyses of a dataset
+    """
+    report = prefix + "_rescued_extended_assemble.report"
+    return {
+        "overlaps": [prefix + "_readToDescr.txt", prefix + "_overlaps.txt", report],
+        "extensions": [prefix + "_extends.txt", report]
+    }
+
+
+def analyzePrefix(task):
+    """
+    Runs analyses of one dataset; executed in worker processes
+
+    Arguments:
+        task -- (prefix, chunk size, quality thresholds or None, list of analyses to run)
+
+    Returns:
+        (prefix, dict analysis -> record, error message or None)
+    """
+    prefix, chunkSize, thresholds, analyses = task
+    try:
+        records = {}
+        with stageTrace.stage("analyzePrefix", prefix=prefix):
+            clonesTotal = readClonesTotal(prefix + "_rescued_extended_assemble.report")
+
+            if "overlaps" in analyses:
+                records["overlaps"] = {"inputFile": prefix + "_overlaps.txt", "clonesTotal": clonesTotal}
+                records["overlaps"].update(analyzeOverlaps(prefix + "_readToDescr.txt", prefix + "_overlaps.txt",
+                                                           chunkSize, thresholds))
+
+            if "extensions" in analyses:
+                records["extensions"] = {"inputFile": prefix + "_extends.txt", "clonesTotal": clonesTotal}
+                records["extensions"].update(countFalseExtensionsInFile(prefix + "_extends.txt", chunkSize))
+
+        return prefix, records, None
+    except Exception:
+        return prefix, None, traceback.format_exc()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimates false overlap and false extension rates for all simulated datasets")
+    parser.add_argument("directory", nargs="?", default=".", help="directory with fpEstimation_* files (default: current)")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="number of alignments processed at once (default: %(default)s)")
+    parser.add_argument("--quality-sweep", metavar="START:STOP[:STEP]",
+                        help="also report cumulative overlap counters for each minQualCDR3 threshold in the range")
+    parser.add_argument("--store", default="falsePositivesResults.sqlite",
+                        help="results store, datasets with unchanged inputs are not analysed again (default: %(default)s)")
+    parser.add_argument("--force", action="store_true", help="analyse all datasets even if stored results are up to date")
+    parser.add_argument("--overlaps-output", default="falseOverlapsResults.txt",
+                        help="output JSONL with false overlaps statistics (default: %(default)s)")
+    parser.add_argument("--extensions-output", default="falseExtensionsResults.txt",
+                        help="output JSONL with false extensions statistics (default: %(default)s)")
+    parser.add_argument("--trace", metavar="FILE", help="append per-stage timing and memory records to FILE (see stageTrace.py)")
+    args = parser.parse_args()
+    if args.trace:
+        stageTrace.configure(args.trace)
+
+    store = ResultsStore(args.store)
+    thresholds = parseThresholds(args.quality_sweep) if args.quality_sweep else None
+    # stored overlap results are valid only for the same sweep
+    versions = {"overlaps": OVERLAPS_VERSION if thresholds is None else "%s;qualitySweep=%s" % (OVERLAPS_VERSION, thresholds),
+                "extensions": EXTENSIONS_VERSION}
+    prefixes = findPrefixes(args.directory)
+    failed = []
+    with stageTrace.stage("fingerprints") as stage:
+        fingerprints = dict((analysis, {}) for analysis in ANALYSES)
+        for prefix in prefixes:
+            try:
+                prefixFingerprints = dict((analysis, store.fingerprint(files, versions[analysis]))
+                                          for analysis, files in inputFiles(prefix).items())
+            except OSError as e:
+                failed.append(prefix)
+                sys.stderr.write("Failed to analyze %s: %s\n" % (prefix, e))
+                for analysis in ANALYSES:
+                    store.remove(analysis, prefix)
+                continue
+            # only datasets with fingerprints of all analyses are analysed
+            for analysis, fingerprint in prefixFingerprints.items():
+                fingerprints[analysis][prefix] = fingerprint
+        stage.add_rows(len(prefixes))
+    current = dict((analysis, {} if args.force else store.current(analysis, fingerprints[analysis]))
+                   for analysis in ANALYSES)
+
+    tasks = []
+    for prefix in prefixes:
+        if prefix in failed:
+            continue
+        analyses = [a for a in ANALYSES if prefix not in current[a]]
+        if analyses:
+            tasks.append((prefix, args.chunk_size, thresholds, analyses))
+    sys.stderr.write("%s of %s datasets are up to date\n" % (len(prefixes) - len(failed) - len(tasks), len(prefixes)))
+
+    if tasks:
+        pool = multiprocessing.Pool(max(1, min(args.jobs, len(tasks))))
+        for prefix, records, error in pool.imap_unordered(analyzePrefix, tasks):
+            if error is not None:
+                failed.append(prefix)
+                sys.stderr.write("Failed to analyze %s:\n%s\n" % (prefix, error))
+                for analysis in ANALYSES:
+                    store.remove(analysis, prefix)
+                continue
+            for analysis, record in records.items():
+                store.put(analysis, prefix, fingerprints[analysis][prefix], record)
+                current[analysis][prefix] = record
+        pool.close()
+        pool.join()
+    # statistics scripts read only datasets of this run from the store
+    store.setLatestRun([prefix for prefix in prefixes if prefix not in failed])
+
+    for analysis, output in [("overlaps", args.overlaps_output), ("extensions", args.extensions_output)]:
+        with open(output, "w") as f:
+            for prefix in prefixes:
+                if prefix not in failed:
+                    f.write(json.dumps(current[analysis][prefix]) + "\n")
+
+    if failed:
+        sys.stderr.write("%s of %s datasets failed\n" % (len(failed), len(prefixes)))
+        sys.exit(1)
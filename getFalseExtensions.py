@@ -1,66 +1,201 @@
 #!/usr/bin/env python
 import numpy as np
 import pandas as pd
-import re
+import argparse
 import json
 import sys
 
-inputFile = sys.argv[1]
-assembleReport = sys.argv[2]
-
-extensions = pd.read_table(inputFile)
-numericColumns = ["refPoints","readSequence", "targetDescriptions"]
-otherColumns = ["allVHitsWithScore","allJHitsWithScore"]
-extensionsR1 = extensions.descrR1.rename("descr").to_frame()
-
-for c in numericColumns:
-    extensionsR1[c] = extensions[c].str.split(",").apply(lambda d: d[0])
-for c in otherColumns:
-    extensionsR1[c] = extensions[c]
-
-extensionsR2 = extensions.descrR1.rename("descr").to_frame()
-for c in numericColumns:
-    extensionsR2[c] = extensions[c].str.split(",").apply(lambda d: d[1] if len(d) > 1 else "")
-for c in otherColumns:
-    extensionsR2[c] = extensions[c]
-
-extensionsR2 = extensionsR2[extensionsR2.refPoints != ""]
-extensionsFull = extensionsR1.append(extensionsR2, ignore_index=True)
-anchorPointsRegex="^(?:-?[0-9]*:){8}(?:-?[0-9]*):(?P<CDR3Begin>-?[0-9]*):(?P<V3Deletion>-?[0-9]*):(?P<VEnd>-?[0-9]*):(?P<DBegin>-?[0-9]*):(?P<D5Deletion>-?[0-9]*):(?P<D3Deletion>-?[0-9]*):(?P<DEnd>-?[0-9]*):(?P<JBegin>-?[0-9]*):(?P<J5Deletion>-?[0-9]*):(?P<CDR3End>-?[0-9]*):(?:-?[0-9]*:){2}(?:-?[0-9]*)$"
-extensionsFull = pd.concat([extensionsFull, extensionsFull.refPoints.str.extract(anchorPointsRegex, expand=True).apply(pd.to_numeric)], axis=1)
-extensionsFull["trueCDR3"] = extensionsFull.descr.str.split("|").apply(lambda d: d[1])
-extensionsFull["topVScore"] = extensionsFull.allVHitsWithScore.str.extract("^[^(]+\((?P<extended>[0-9.]+)\)", expand=False).apply(pd.to_numeric)
-extensionsFull["topJScore"] = extensionsFull.allJHitsWithScore.str.extract("^[^(]+\((?P<extended>[0-9.]+)\)", expand=False).apply(pd.to_numeric)
-
-extensionsLEx = extensionsFull[extensionsFull.targetDescriptions.str.contains("LExtended")]
-extensionsLEx = pd.concat([extensionsLEx, extensionsLEx.targetDescriptions.str.extract("LExtended\((?P<extended>[0-9]+)\)", expand=True).apply(pd.to_numeric)], axis=1)
-extensionsLEx["actualExtension"] = extensionsLEx.apply(lambda row: row.readSequence[:row.extended], axis=1)
-extensionsLEx["expectedExtension"] = extensionsLEx.apply(lambda row: row.trueCDR3[:row.extended], axis=1)
-# extensionsLEx[extensionsLEx.actualExtension != extensionsLEx.expectedExtension]
-
-extensionsREx = extensionsFull[extensionsFull.targetDescriptions.str.contains("[RM]Extended")]
-extensionsREx = pd.concat([extensionsREx, extensionsREx.targetDescriptions.str.extract("\[(?P<offset>[0-9]+)\] \+ [RM]Extended\((?P<extended>[0-9]+)\)", expand=True).apply(pd.to_numeric)], axis=1)
-extensionsREx["actualExtension"] = extensionsREx.apply(lambda row: row.readSequence[row.offset:(row.offset + row.extended)], axis=1)
-extensionsREx["offsetInTrueCDR3"] = extensionsREx.offset - extensionsREx.CDR3End + extensionsREx.trueCDR3.str.len()
-extensionsREx["offsetInTrueCDR3L"] = extensionsREx.offset - extensionsREx.CDR3Begin
-extensionsREx.loc[extensionsREx.offsetInTrueCDR3.isnull(), "offsetInTrueCDR3"] = extensionsREx.loc[extensionsREx.offsetInTrueCDR3.isnull(), "offsetInTrueCDR3L"] 
-extensionsREx["expectedExtension"] = extensionsREx.apply(lambda row: row.trueCDR3[int(row.offsetInTrueCDR3):int(row.offsetInTrueCDR3 + row.extended)], axis=1)
-# extensionsREx[extensionsREx.actualExtension != extensionsREx.expectedExtension]
-
-clones = 0
-for line in open(assembleReport,'r'):
-    m = re.search("Reads used in clonotypes, percent of total: ([0-9]+)", line)
-    if m:
-        clones = int(m.group(1))
-        break
-
-result = {
-    "inputFile": inputFile,
-    "clonesTotal": clones,
-    "totalRExtensions": len(extensionsREx),
-    "totalLExtensions": len(extensionsLEx),
-    "falseRExtensions": int((extensionsREx.actualExtension != extensionsREx.expectedExtension).sum()),
-    "falseLExtensions": int((extensionsLEx.actualExtension != extensionsLEx.expectedExtension).sum())
-}
-
-print(json.dumps(result))
+import stageTrace
+from mixcrReports import readClonesTotal
+
+# Columns of exportAlignments output used for the analysis
+COLUMNS = ["descrR1", "refPoints", "readSequence", "targetDescriptions"]
+# Per-read columns, values for R1 and R2 are separated by ","
+perReadColumns = ["refPoints", "readSequence", "targetDescriptions"]
+
+# Default number of alignments processed at once; peak memory grows by
+# about 1.3 KB per alignment of a chunk
+CHUNK_SIZE = 100000
+# Increment when countFalseExtensions results change (invalidates stored results, see resultsStore.py)
+VERSION = 1
+
+# Layout of -defaultAnchorPoints: 22 ":"-separated fields, only CDR3 bounds
+# (fields 9 and 18) are extracted
+ANCHOR_POINTS_RX = r"^(?:[^:]*:){9}(?P<CDR3Begin>[^:]*):(?:[^:]*:){8}(?P<CDR3End>[^:]*):(?:[^:]*:){2}[^:]*$"
+# Missing anchor point
+NA = np.iinfo(np.int32).min
+
+
+def cdr3Bounds(refPoints):
+    """
+    Parses CDR3 begin and end from refPoints column
+
+    Returns:
+        (CDR3Begin, CDR3End) int32 arrays, NA for missing values and
+        malformed refPoints
+    """
+    bounds = refPoints.str.extract(ANCHOR_POINTS_RX, expand=True)
+    return tuple(pd.to_numeric(bounds[c], errors="coerce").fillna(NA).values.astype(np.int32)
+                 for c in ["CDR3Begin", "CDR3End"])
+
+
+def byteMatrix(strings):
+    """
+    Fixed-width uint8 view of a column of strings
+    """
+    data = np.array(strings.values.astype(str), dtype="S")
+    return data.view(np.uint8).reshape(len(data), data.dtype.itemsize)
+
+
+def normalizeSlice(start, stop, length):
+    """
+    Vectorized Python slice semantics: returns actual (start, length) of
+    s[start:stop] for strings of given lengths
+    """
+    start = np.where(start < 0, np.maximum(start + length, 0), np.minimum(start, length))
+    stop = np.where(stop < 0, np.maximum(stop + length, 0), np.minimum(stop, length))
+    return start, np.maximum(stop - start, 0)
+
+
+def sliceEquals(a, aStart, aStop, b, bStart, bStop):
+    """
+    Vectorized a[i][aStart[i]:aStop[i]] == b[i][bStart[i]:bStop[i]]
+
+    Arguments:
+        a, b               -- Series of strings
+        aStart, aStop, ... -- int64 arrays of slice bounds
+
+    Missing strings are compared as empty ones.
+    """
+    a, b = a.fillna(""), b.fillna("")
+    aBytes, bBytes = byteMatrix(a), byteMatrix(b)
+    aStart, aLength = normalizeSlice(aStart, aStop, a.str.len().values)
+    bStart, bLength = normalizeSlice(bStart, bStop, b.str.len().values)
+    equal = aLength == bLength
+    width = aLength[equal].max() if equal.any() else 0
+    positions = np.arange(width)
+    rows = np.arange(len(a))[:, None]
+    inSlice = positions[None, :] < aLength[:, None]
+    aChars = aBytes[rows, np.minimum(aStart[:, None] + positions, aBytes.shape[1] - 1)]
+    bChars = bBytes[rows, np.minimum(bStart[:, None] + positions, bBytes.shape[1] - 1)]
+    return equal & ~((aChars != bChars) & inSlice).any(axis=1)
+
+
+def splitReads(extensions):
+    """
+    Splits each paired alignment into separate records for R1 and R2
+    """
+    parts = dict((c, extensions[c].str.split(",", expand=True)) for c in perReadColumns)
+    reads = []
+    for i in [0, 1]:
+        read = pd.DataFrame({"descr": extensions.descrR1.values})
+        for c in perReadColumns:
+            read[c] = parts[c][i].values if i in parts[c].columns else None
+        reads.append(read)
+    # single-end alignments have no R2
+    reads[1] = reads[1][reads[1].refPoints.notnull() & (reads[1].refPoints != "")]
+    return pd.concat(reads, ignore_index=True)
+
+
+def countFalseExtensions(extensions):
+    """
+    Compares sequences added by extendAlignments with the true CDR3 sequences
+
+    Arguments:
+        extensions -- DataFrame with exportAlignments output (COLUMNS)
+
+    Returns:
+        dict with total and false numbers of left and right extensions
+    """
+    with stageTrace.stage("splitReads") as stage:
+        reads = splitReads(extensions)
+        cdr3Begin, cdr3End = cdr3Bounds(reads.refPoints)
+        trueCDR3 = reads.descr.str.extract(r"^[^|]*\|([^|]*)", expand=False)
+        stage.add_rows(len(reads))
+
+    with stageTrace.stage("leftExtensions") as stage:
+        isLEx = reads.targetDescriptions.str.contains("LExtended", regex=False).values
+        lEx = reads[isLEx]
+        extended = pd.to_numeric(lEx.targetDescriptions.str.extract(r"LExtended\((?P<extended>[0-9]+)\)", expand=False)).values
+        valid = ~np.isnan(extended) & lEx.readSequence.notnull().values & trueCDR3[isLEx].notnull().values
+        extended = np.nan_to_num(extended).astype(np.int64)
+        zero = np.zeros(len(lEx), dtype=np.int64)
+        correctLEx = valid & sliceEquals(lEx.readSequence, zero, extended, trueCDR3[isLEx], zero, extended)
+        stage.add_rows(len(lEx))
+
+    with stageTrace.stage("rightExtensions") as stage:
+        isREx = reads.targetDescriptions.str.contains("[RM]Extended").values
+        rEx = reads[isREx]
+        parsed = rEx.targetDescriptions.str.extract(r"\[(?P<offset>[0-9]+)\] \+ [RM]Extended\((?P<extended>[0-9]+)\)", expand=True)
+        offset = pd.to_numeric(parsed.offset).values
+        extended = pd.to_numeric(parsed.extended).values
+        rTrueCDR3 = trueCDR3[isREx]
+        rCDR3Begin = cdr3Begin[isREx].astype(np.float64)
+        rCDR3End = cdr3End[isREx].astype(np.float64)
+        rCDR3Begin[rCDR3Begin == NA] = np.nan
+        rCDR3End[rCDR3End == NA] = np.nan
+        # offset of the extension in true CDR3 counted from its end, or from its beginning if CDR3 end is unknown
+        offsetInTrueCDR3 = offset - rCDR3End + rTrueCDR3.str.len().values
+        offsetInTrueCDR3 = np.where(np.isnan(offsetInTrueCDR3), offset - rCDR3Begin, offsetInTrueCDR3)
+        valid = ~(np.isnan(offset) | np.isnan(extended) | np.isnan(offsetInTrueCDR3))
+        valid &= rEx.readSequence.notnull().values & rTrueCDR3.notnull().values
+        offset, extended, offsetInTrueCDR3 = [np.nan_to_num(v).astype(np.int64) for v in [offset, extended, offsetInTrueCDR3]]
+        correctREx = valid & sliceEquals(rEx.readSequence, offset, offset + extended,
+                                         rTrueCDR3, offsetInTrueCDR3, offsetInTrueCDR3 + extended)
+        stage.add_rows(len(rEx))
+
+    return {
+        "totalRExtensions": len(rEx),
+        "totalLExtensions": len(lEx),
+        "falseRExtensions": int((~correctREx).sum()),
+        "falseLExtensions": int((~correctLEx).sum())
+    }
+
+
+def countFalseExtensionsInFile(inputFile, chunkSize=CHUNK_SIZE, progress=False):
+    """
+    Streams exportAlignments output in chunks and accumulates false
+    extension counters, so memory usage does not depend on file size
+
+    Arguments:
+        inputFile -- path to exportAlignments output
+        chunkSize -- number of alignments per chunk (0 to load the whole file at once)
+        progress  -- print per-chunk progress to stderr
+    """
+    with stageTrace.stage("countFalseExtensions", inputFile=inputFile) as stage:
+        if chunkSize <= 0:
+            extensions = pd.read_table(inputFile, usecols=COLUMNS, dtype=str)
+            stage.add_rows(len(extensions))
+            return countFalseExtensions(extensions)
+
+        total = dict.fromkeys(["totalRExtensions", "totalLExtensions", "falseRExtensions", "falseLExtensions"], 0)
+        alignments = 0
+        for i, chunk in enumerate(pd.read_table(inputFile, usecols=COLUMNS, dtype=str, chunksize=chunkSize)):
+            for key, value in countFalseExtensions(chunk).items():
+                total[key] += value
+            alignments += len(chunk)
+            stage.add_rows(len(chunk))
+            if progress:
+                sys.stderr.write("%s: chunk %s, %s alignments processed\n" % (inputFile, i + 1, alignments))
+        return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimates rate of false extensions produced by MiXCR extendAlignments")
+    parser.add_argument("inputFile", help="exportAlignments output (extends.txt)")
+    parser.add_argument("assembleReport", help="MiXCR assemble report")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="number of alignments processed at once, 0 to load the whole file (default: %(default)s)")
+    parser.add_argument("--progress", action="store_true", help="print per-chunk progress to stderr")
+    parser.add_argument("--trace", metavar="FILE", help="append per-stage timing and memory records to FILE (see stageTrace.py)")
+    args = parser.parse_args()
+    if args.trace:
+        stageTrace.configure(args.trace)
+
+    result = {
+        "inputFile": args.inputFile,
+        "clonesTotal": readClonesTotal(args.assembleReport)
+    }
+    result.update(countFalseExtensionsInFile(args.inputFile, args.chunk_size, args.progress))
+
+    print(json.dumps(result))
@@ -1,43 +1,218 @@
 #!/usr/bin/env python
 import numpy as np
 import pandas as pd
-import re
+import argparse
 import json
-import sys
-
-readToDescrFile = sys.argv[1]
-overlapped = sys.argv[2]
-assembleReport = sys.argv[3]
-
-readIdToCDR3 = pd.read_table(readToDescrFile)
-readIdToCDR3["CDR3"] = readIdToCDR3.descrR1.str.extract("GClone\|([^|]*)\|", expand=False)
-del readIdToCDR3["descrR1"]
-rescued = pd.read_table(overlapped)
-rescued["targetDescriptionsNoBrackets"] = rescued.targetDescriptions.str.replace(r'\[[^\[\]]*\]', '')
-rx="VJOverlap\([0-9]+\) = [LR](?P<R1>[0-9]+)\.[01] \+ [LR](?P<R2>[0-9]+)\.[01]"
-rescued = pd.concat([rescued, rescued.targetDescriptionsNoBrackets.str.extract(rx, expand=True).apply(pd.to_numeric)], axis=1)
-m1 = rescued.merge(readIdToCDR3, left_on="R1", right_on="readId", how="inner")
-m2 = m1.merge(readIdToCDR3, left_on="R2", right_on="readId", how="inner")
-
-clones = 0
-for line in open(assembleReport,'r'):
-    m = re.search("Reads used in clonotypes, percent of total: ([0-9]+)", line)
-    if m:
-        clones = int(m.group(1))
-        break
-
-result = {
-    "inputFile": overlapped,
-    "clonesTotal": clones,
-    "totalAlignments": len(rescued),
-    "totalAlignmentsWithCDR3": int(rescued.nSeqCDR3.notnull().sum()),
-    "totalOverlaps": len(m2),
-    "hqOverlaps": int((m2.minQualCDR3.fillna(0.0) >= 20).sum()),
-    "correctOverlaps": int((m2.CDR3_x == m2.CDR3_y).sum()),
-    "overlapsFromDifferentClones": int((m2.CDR3_x != m2.CDR3_y).sum()),
-    "overlapsProducingNewCDR3": int(((m2.CDR3_x != m2.nSeqCDR3) & (m2.CDR3_y != m2.nSeqCDR3) & (m2.CDR3_x != m2.CDR3_y)).sum()), 
-    "hqOverlapsProducingNewCDR3": int(((m2.minQualCDR3.fillna(0.0) >= 20) & (m2.CDR3_x != m2.nSeqCDR3) & (m2.CDR3_y != m2.nSeqCDR3) & (m2.CDR3_x != m2.CDR3_y)).sum()),
-    "newCDR3Diversity": len(m2.loc[(m2.CDR3_x != m2.nSeqCDR3) & (m2.CDR3_y != m2.nSeqCDR3) & (m2.CDR3_x != m2.CDR3_y), "nSeqCDR3"].unique()), 
-    "hqNewCDR3Diversity": len(m2.loc[(m2.minQualCDR3.fillna(0.0) >= 20) & (m2.CDR3_x != m2.nSeqCDR3) & (m2.CDR3_y != m2.nSeqCDR3) & (m2.CDR3_x != m2.CDR3_y), "nSeqCDR3"].unique()) 
-}
-print(json.dumps(result))
+
+import stageTrace
+from mixcrReports import readClonesTotal
+
+# Default number of alignments processed at once; peak memory grows by
+# about 0.35 KB per alignment of a chunk
+CHUNK_SIZE = 100000
+# Increment when analyzeOverlaps results change (invalidates stored results, see resultsStore.py)
+VERSION = 1
+
+rx=r"VJOverlap\([0-9]+\) = [LR](?P<R1>[0-9]+)\.[01] \+ [LR](?P<R2>[0-9]+)\.[01]"
+
+
+class ReadIdIndex:
+    """
+    Maps MiXCR readIds (dense integers) to integer codes of true CDR3
+    sequences; each CDR3 string is stored only once
+    """
+
+    # readId is not present in the index
+    ABSENT = -2
+    # no CDR3 (nan)
+    NO_CDR3 = -1
+
+    def __init__(self):
+        self.readCodes = np.full(1024, ReadIdIndex.ABSENT, dtype=np.int32)
+        self.cdr3Codes = {}
+
+    def encode(self, cdr3):
+        """
+        Integer codes of CDR3 sequences (Series); unseen sequences get new codes
+        """
+        codes, uniques = pd.factorize(cdr3)
+        mapping = np.array([self.cdr3Codes.setdefault(s, len(self.cdr3Codes)) for s in uniques] + [ReadIdIndex.NO_CDR3],
+                           dtype=np.int32)
+        # factorize marks nan with -1, which picks the last element
+        return mapping[codes]
+
+    def add(self, readIds, cdr3):
+        """
+        Adds readId -> CDR3 records
+
+        Arguments:
+            readIds -- int array of readIds
+            cdr3    -- Series of true CDR3 sequences
+        """
+        if len(readIds) == 0:
+            return
+        size = len(self.readCodes)
+        while size <= readIds.max():
+            size *= 2
+        if size != len(self.readCodes):
+            readCodes = np.full(size, ReadIdIndex.ABSENT, dtype=np.int32)
+            readCodes[:len(self.readCodes)] = self.readCodes
+            self.readCodes = readCodes
+        self.readCodes[readIds] = self.encode(cdr3)
+
+    def lookup(self, readIds):
+        """
+        CDR3 codes for readIds (float array, nan for missing readIds)
+        """
+        known = ~np.isnan(readIds)
+        known[known] = readIds[known] < len(self.readCodes)
+        codes = np.full(len(readIds), ReadIdIndex.ABSENT, dtype=np.int32)
+        codes[known] = self.readCodes[readIds[known].astype(np.int64)]
+        return codes
+
+    @staticmethod
+    def fromFile(readToDescrFile, chunkSize=CHUNK_SIZE):
+        """
+        Streams exportAlignments -readId -descrR1 output into the index
+        """
+        index = ReadIdIndex()
+        with stageTrace.stage("readIdIndex", inputFile=readToDescrFile) as stage:
+            for chunk in pd.read_table(readToDescrFile, usecols=["readId", "descrR1"], chunksize=chunkSize,
+                                       dtype={"readId": np.int64, "descrR1": str}):
+                index.add(chunk.readId.values, chunk.descrR1.str.extract(r"GClone\|([^|]*)\|", expand=False))
+                stage.add_rows(len(chunk))
+        return index
+
+
+def same(a, b):
+    """
+    Equality of CDR3 codes, nan is not equal to anything
+    """
+    return (a == b) & (a >= 0)
+
+
+def parseThresholds(value):
+    """
+    Parses START:STOP[:STEP] range of quality thresholds (STOP included)
+    """
+    bounds = [int(v) for v in value.split(":")]
+    if len(bounds) not in (2, 3) or (len(bounds) == 3 and bounds[2] <= 0):
+        raise ValueError("expected START:STOP[:STEP], got %s" % value)
+    start, stop, step = bounds if len(bounds) == 3 else bounds + [1]
+    return list(range(start, stop + 1, step))
+
+
+def qualitySweep(quality, newCDR3, cdr3, thresholds):
+    """
+    Cumulative overlap counters for overlaps with quality >= each threshold
+
+    Arguments:
+        quality    -- minQualCDR3 of overlaps
+        newCDR3    -- bool array, whether overlap produced a new CDR3
+        cdr3       -- codes of resulting CDR3s
+        thresholds -- list of quality thresholds
+
+    Returns:
+        dict with thresholds and lists of overlaps, overlapsProducingNewCDR3
+        and newCDR3Diversity at each threshold
+    """
+    values = np.asarray(thresholds, dtype=np.float64)
+    order = np.argsort(-quality, kind="stable")
+    descending = -quality[order]
+    # number of overlaps with quality >= threshold
+    counts = np.searchsorted(descending, -values, side="right")
+    newCumulative = np.concatenate([[0], np.cumsum(newCDR3[order])])
+    # a new CDR3 is counted at all thresholds up to the best quality it was produced with
+    _, first = np.unique(cdr3[order][newCDR3[order]], return_index=True)
+    bestQuality = np.sort(descending[newCDR3[order]][first])
+    return {
+        "thresholds": list(thresholds),
+        "overlaps": counts.tolist(),
+        "overlapsProducingNewCDR3": newCumulative[counts].tolist(),
+        "newCDR3Diversity": np.searchsorted(bestQuality, -values, side="right").tolist()
+    }
+
+
+def analyzeOverlaps(readToDescrFile, overlapped, chunkSize=CHUNK_SIZE, thresholds=None):
+    """
+    Checks overlaps produced by assemblePartial against the true CDR3s of
+    the overlapped reads
+
+    Arguments:
+        readToDescrFile -- exportAlignments -readId -descrR1 output for initial alignments
+        overlapped      -- exportAlignments output for rescued alignments
+        chunkSize       -- number of alignments processed at once
+        thresholds      -- optional list of quality thresholds for qualitySweep
+
+    Returns:
+        dict with overlap counters (and "qualitySweep" if thresholds are given)
+    """
+    index = ReadIdIndex.fromFile(readToDescrFile, chunkSize)
+
+    totalAlignments = 0
+    totalAlignmentsWithCDR3 = 0
+    # true CDR3 of R1 and R2, resulting CDR3 and its quality for each overlap
+    cdr3R1, cdr3R2, cdr3, quality = [], [], [], []
+    with stageTrace.stage("lookupOverlaps", inputFile=overlapped) as stage:
+        for chunk in pd.read_table(overlapped, usecols=["minQualCDR3", "targetDescriptions", "nSeqCDR3"],
+                                   chunksize=chunkSize, dtype={"targetDescriptions": str, "nSeqCDR3": str}):
+            totalAlignments += len(chunk)
+            totalAlignmentsWithCDR3 += int(chunk.nSeqCDR3.notnull().sum())
+            targetDescriptionsNoBrackets = chunk.targetDescriptions.str.replace(r'\[[^\[\]]*\]', '', regex=True)
+            reads = targetDescriptionsNoBrackets.str.extract(rx, expand=True).apply(pd.to_numeric)
+            r1 = index.lookup(reads.R1.values.astype(np.float64))
+            r2 = index.lookup(reads.R2.values.astype(np.float64))
+            found = (r1 != ReadIdIndex.ABSENT) & (r2 != ReadIdIndex.ABSENT)
+            cdr3R1.append(r1[found])
+            cdr3R2.append(r2[found])
+            cdr3.append(index.encode(chunk.nSeqCDR3[found]))
+            quality.append(chunk.minQualCDR3.fillna(0.0).values[found])
+            stage.add_rows(len(chunk))
+
+    with stageTrace.stage("countOverlaps") as stage:
+        x, y, n = [np.concatenate(c) if c else np.zeros(0, dtype=np.int32) for c in [cdr3R1, cdr3R2, cdr3]]
+        quality = np.concatenate(quality) if quality else np.zeros(0)
+        hq = quality >= 20
+        newCDR3 = ~same(x, n) & ~same(y, n) & ~same(x, y)
+        stage.add_rows(len(x))
+
+        result = {
+            "totalAlignments": totalAlignments,
+            "totalAlignmentsWithCDR3": totalAlignmentsWithCDR3,
+            "totalOverlaps": len(x),
+            "hqOverlaps": int(hq.sum()),
+            "correctOverlaps": int(same(x, y).sum()),
+            "overlapsFromDifferentClones": int((~same(x, y)).sum()),
+            "overlapsProducingNewCDR3": int(newCDR3.sum()),
+            "hqOverlapsProducingNewCDR3": int((hq & newCDR3).sum()),
+            "newCDR3Diversity": len(np.unique(n[newCDR3])),
+            "hqNewCDR3Diversity": len(np.unique(n[hq & newCDR3]))
+        }
+
+    if thresholds is not None:
+        with stageTrace.stage("qualitySweep") as stage:
+            result["qualitySweep"] = qualitySweep(quality, newCDR3, n, thresholds)
+            stage.add_rows(len(quality))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimates rate of false overlaps produced by MiXCR assemblePartial")
+    parser.add_argument("readToDescrFile", help="exportAlignments -readId -descrR1 output (readToDescr.txt)")
+    parser.add_argument("overlapped", help="exportAlignments output for rescued alignments (overlaps.txt)")
+    parser.add_argument("assembleReport", help="MiXCR assemble report")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="number of alignments processed at once (default: %(default)s)")
+    parser.add_argument("--quality-sweep", metavar="START:STOP[:STEP]", type=parseThresholds,
+                        help="also report cumulative counters for each minQualCDR3 threshold in the range")
+    parser.add_argument("--trace", metavar="FILE", help="append per-stage timing and memory records to FILE (see stageTrace.py)")
+    args = parser.parse_args()
+    if args.trace:
+        stageTrace.configure(args.trace)
+
+    result = {
+        "inputFile": args.overlapped,
+        "clonesTotal": readClonesTotal(args.assembleReport)
+    }
+    result.update(analyzeOverlaps(args.readToDescrFile, args.overlapped, args.chunk_size, args.quality_sweep))
+    print(json.dumps(result))
@@ -0,0 +1,121 @@
+"""
+Persistent on-disk cache of CDR3 search results
+
+Results are stored in an SQLite database and keyed by a fingerprint of
+the searched set of true sequences (including the search mode) and by
+the query sequence, so they survive between runs and stay valid as long
+as the true clone set is unchanged.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+
+# maximal number of host parameters in a single SQLite statement
+SQL_BATCH = 500
+
+
+class MatchCache:
+    """
+    A size-bounded cache of (query -> closest true sequence, distance)
+    search results
+
+    Least recently used entries are evicted when the number of entries
+    exceeds max_entries.
+    """
+
+    def __init__(self, path, max_entries=10000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = None
+        self.connection_pid = None
+
+    @staticmethod
+    def fingerprint(values, mode):
+        """
+        Fingerprint of the searched sequences
+
+        Arguments:
+            values -- ordered list of searched sequences
+            mode   -- string describing the search mode (e.g. 'nSeqCDR3:end_to_end')
+        """
+        h = hashlib.sha1()
+        h.update(mode.encode('utf-8'))
+        for v in values:
+            h.update(b'\n')
+            h.update(v.encode('utf-8'))
+        return h.hexdigest()
+
+    def _connect(self):
+        # connections can't be shared with forked worker processes
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=600)
+            self.connection_pid = os.getpid()
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS matches (
+                                         fingerprint TEXT NOT NULL,
+                                         query       TEXT NOT NULL,
+                                         maxerr      INTEGER NOT NULL,
+                                         match       INTEGER,
+                                         error       INTEGER,
+                                         used        REAL NOT NULL,
+                                         PRIMARY KEY (fingerprint, query))""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS matches_used ON matches (used)")
+            self.connection.commit()
+        return self.connection
+
+    def get(self, fingerprint, queries, maxerr):
+        """
+        Looks up cached search results
+
+        Arguments:
+            fingerprint -- fingerprint of the searched sequences
+            queries     -- list of distinct query sequences
+            maxerr      -- maximal allowed number of errors
+
+        Returns:
+            dict query -> (index of the matched value, distance) or (None, None)
+            if there is no match within maxerr errors; queries that were never
+            searched with at least maxerr errors are absent
+        """
+        connection = self._connect()
+        result = {}
+        for i in range(0, len(queries), SQL_BATCH):
+            batch = queries[i:i + SQL_BATCH]
+            rows = connection.execute(
+                "SELECT query, maxerr, match, error FROM matches WHERE fingerprint = ? AND query IN (%s)"
+                % ",".join("?" * len(batch)), [fingerprint] + list(batch)).fetchall()
+            for query, cached_maxerr, match, error in rows:
+                if error is not None:
+                    # the closest match does not depend on the error threshold
+                    result[query] = (match, error) if error <= maxerr else (None, None)
+                elif maxerr <= cached_maxerr:
+                    result[query] = (None, None)
+        if result:
+            now = time.time()
+            with connection:
+                connection.executemany("UPDATE matches SET used = ? WHERE fingerprint = ? AND query = ?",
+                                       [(now, fingerprint, q) for q in result])
+        return result
+
+    def put(self, fingerprint, results, maxerr):
+        """
+        Stores search results
+
+        Arguments:
+            fingerprint -- fingerprint of the searched sequences
+            results     -- dict query -> (index of the matched value, distance)
+                           or (None, None) if not matched
+            maxerr      -- maximal number of errors the search was performed with
+        """
+        if not results:
+            return
+        connection = self._connect()
+        now = time.time()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(fingerprint, q, maxerr, m, e, now) for q, (m, e) in results.items()])
+            excess = connection.execute("SELECT COUNT(*) FROM matches").fetchone()[0] - self.max_entries
+            if excess > 0:
+                connection.execute("DELETE FROM matches WHERE rowid IN "
+                                   "(SELECT rowid FROM matches ORDER BY used LIMIT ?)", (excess,))
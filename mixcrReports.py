@@ -0,0 +1,18 @@
+"""
+Parsers of MiXCR report files
+"""
+import re
+
+
+def readClonesTotal(assembleReport):
+    """
+    Reads "Reads used in clonotypes, percent of total" from MiXCR assemble
+    report (0 if absent)
+    """
+    clones = 0
+    for line in open(assembleReport,'r'):
+        m = re.search("Reads used in clonotypes, percent of total: ([0-9]+)", line)
+        if m:
+            clones = int(m.group(1))
+            break
+    return clones
@@ -1,15 +1,27 @@
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+"""
+Comparison of MiXCR and TRUST on in-silico generated RNA-Seq data
+
+    python plotMiXCRvsTRUST.py                # update statistics and render the figure
+    python plotMiXCRvsTRUST.py --stats-only   # only update statistics (AllStats.tsv)
+    python plotMiXCRvsTRUST.py --render-only  # only render the figure from AllStats.tsv
+
+Statistics of each (sample, software) pair are stored in the AllStats
+table together with a fingerprint of their inputs, and are recomputed only
+when the inputs change. Importing the module does no work, matplotlib is
+imported only for rendering.
+"""
+import argparse
+import hashlib
 import numpy as np
 import pandas as pd
-import tre
 import os
+import multiprocessing
 import re
-import matplotlib.gridspec as gridspec
 
-matplotlib.rcParams['pdf.fonttype'] = 42
-matplotlib.rcParams['font.sans-serif']=["Arial"] 
+import stageTrace
+from cdr3Index import CDR3Index
+from matchCache import MatchCache
+from cloneTables import read_mixcr_clones, read_trust_fa, read_in_silico_fasta, TCR_CHAINS, IG_CHAINS
 
 
 # Global options
@@ -18,6 +30,31 @@ STAR_PATH="%s/star"%ROOT_DIRECTORY
 MIXCR_PATH="%s/mixcr"%ROOT_DIRECTORY
 TRUST_PATH="%s/trust"%ROOT_DIRECTORY
 FIGURES="%sfigures"%ROOT_DIRECTORY
+# Number of processes used to compute per-sample statistics
+STATS_PROCESSES=int(os.environ.get('STATS_PROCESSES', multiprocessing.cpu_count()))
+# SQLite file with CDR3 search results of previous runs (empty to disable)
+MATCH_CACHE=os.environ.get('MATCH_CACHE', "%s/.match_cache.sqlite"%ROOT_DIRECTORY)
+MATCH_CACHE_MAX_ENTRIES=int(os.environ.get('MATCH_CACHE_MAX_ENTRIES', 10000000))
+# Per-sample statistics with input fingerprints (see update_stats)
+STATS_FILE="%s/AllStats.tsv"%ROOT_DIRECTORY
+# Increment when get_stats results change (invalidates stored statistics)
+STATS_VERSION=1
+FIGURE="SupplementaryFigure_in_silico.pdf"
+SOFTWARES=['mixcr', 'trust']
+
+
+def true_reads_file_name(chain):
+    return '%s/in_silico_%s.fasta'%(ROOT_DIRECTORY,chain)
+
+def mixcr_file_name(sample):
+    return '%s/in_silico_RNA_Seq_%s%sbp.%s.txt'%(
+        MIXCR_PATH, '' if sample['vdj'] else 'no_VDJ_', 
+        sample['len'], 'paired' if sample['paired'] else 'single')
+
+def trust_file_name(sample):
+    return '%s/in_silico_RNA_Seq_%s%sbp.%s.%s.sorted.bam.fa'%(
+        TRUST_PATH, '' if sample['vdj'] else 'no_VDJ_', 
+        sample['len'], sample['ref'], 'paired' if sample['paired'] else 'single')
 
 
 def parse_true_reads(chain):
@@ -28,23 +65,10 @@ def parse_true_reads(chain):
         chain -- the immunological chain (TRA/IGH/...)
     """
     
-    file_name = '%s/in_silico_%s.fasta'%(ROOT_DIRECTORY,chain)
+    file_name = true_reads_file_name(chain)
     
-    data = {
-        "nSeqCDR3": [], # nucleotide CDR3 sequence
-        "aaSeqCDR3": [] # amino acid CDR3 sequence
-    }
-        
-    with open(file_name, 'r', 4096) as f:
-        content = f.readlines()
-        
-        for line in content:
-            if not line.startswith('>'):
-                continue
-            split = line.split("|")
-            data['nSeqCDR3'].append(split[1])
-            data['aaSeqCDR3'].append(split[2])
-    data = pd.DataFrame.from_dict(data)
+    # nucleotide and amino acid CDR3 sequences
+    data = read_in_silico_fasta(file_name, ['nSeqCDR3', 'aaSeqCDR3'])
     data = data.groupby("nSeqCDR3").first()
     data = data.reset_index()
 
@@ -73,7 +97,7 @@ def parse_bam_file_name(fname):
     fname = fname.replace('.sorted', '')
     
     sample = {'sample_name' : fname.replace('in_silico_RNA_Seq_','')}
-    patt = re.search('in_silico_RNA_Seq_*([a-zA-Z_]*)_([0-9]+)bp\.(hg3[78])\.([a-z]+)', fname)
+    patt = re.search(r'in_silico_RNA_Seq_*([a-zA-Z_]*)_([0-9]+)bp\.(hg3[78])\.([a-z]+)', fname)
     sample['vdj'] = patt.group(1) == ''
     sample['len'] = int(patt.group(2))
     sample['ref'] = patt.group(3)
@@ -94,20 +118,13 @@ def parse_mixcr(sample):
                     }
         
     Returns:
-        DataFrame with MiXCR results obtained for the sample
+        DataFrame with MiXCR results obtained for the sample (CDR3 sequences,
+        top V/J genes and chain; see cloneTables.read_mixcr_clones)
     """
     
-    return pd.read_table('%s/in_silico_RNA_Seq_%s%sbp.%s.txt'%(
-        MIXCR_PATH, '' if sample['vdj'] else 'no_VDJ_', 
-        sample['len'], 'paired' if sample['paired'] else 'single'))
+    return read_mixcr_clones(mixcr_file_name(sample))
 
-def safe_float(s):
-    try:
-        return float(s)
-    except ValueError:
-        return float('nan')
-    
-def parse_trust(sample):
+def parse_trust(sample, fields=('V', 'J', 'nSeqCDR3', 'aaSeqCDR3')):
     """
     Parse TRUST results into DataFrame for specified sample 
 
@@ -119,55 +136,31 @@ def parse_trust(sample):
                         ref    : hg38/hg37
                         paired : paired/single-end input
                     }
+        fields -- TRUST fields to keep (add 'contig' for contig sequences)
         
     Returns:
         DataFrame with TRUST results obtained for the sample
     """
     
-    fileName = '%s/in_silico_RNA_Seq_%s%sbp.%s.%s.sorted.bam.fa'%(
-        TRUST_PATH, '' if sample['vdj'] else 'no_VDJ_', 
-        sample['len'], sample['ref'], 'paired' if sample['paired'] else 'single')
-    data = {
-        "contig": [],
-        "V": [],
-        "J": [],
-        "nSeqCDR3": [],
-        "aaSeqCDR3": [],
-        "freq": []
-    }
-    with open(fileName, 'r', 4096) as f:
-        content = f.readlines()
-        
-        prev = None
-        for line in content:
-
-            if line.startswith("#"):
-                continue
+    return read_trust_fa(trust_file_name(sample), fields)
 
-            if prev and prev.startswith(">"):
-                split = prev[1:-1].split("+")
-                data["contig"].append(line[:-1])
-                data["V"].append(split[4])
-                data["J"].append(split[5])
-                data["nSeqCDR3"].append(split[9])
-                data["aaSeqCDR3"].append(split[7])
-                data["freq"].append(safe_float(split[1][16:]))
 
-            prev = line
-
-    trust = pd.DataFrame.from_dict(data)
-    del trust["freq"]
-    return trust
+def parse_mixcr_chains(sample):
+    """
+    Parse MiXCR results once and split them into TCR and IG clones
 
+    Returns:
+        (TCR clones DataFrame, IG clones DataFrame)
+    """
+    mixcr = parse_mixcr(sample)
+    return mixcr[mixcr['chain'].isin(TCR_CHAINS)], mixcr[mixcr['chain'].isin(IG_CHAINS)]
 
 # will use only TRB clones from MiXCR
 def parse_mixcr_tcr(sample):
-    mixcr = parse_mixcr(sample)
-    return mixcr[mixcr['allVHitsWithScore'].str.contains('^TR[ABDG]V')]
+    return parse_mixcr_chains(sample)[0]
 
 def parse_mixcr_ig(sample):
-    mixcr = parse_mixcr(sample)
-    return mixcr[mixcr['allVHitsWithScore'].str.contains('^IG[HKL]V')]
+    return parse_mixcr_chains(sample)[1]
 
 
 class TrueClonesDb:
@@ -177,39 +170,161 @@ class TrueClonesDb:
     
     """
     
-    def __init__(self, true_clones_df, nt=True):
+    def __init__(self, true_clones_df, nt=True, cache=None):
+        """
+        Arguments:
+            true_clones_df -- DataFrame with true clones
+            nt             -- search by nucleotide (True) or amino acid (False) CDR3
+            cache          -- optional MatchCache with search results of previous runs
+        """
         self.true_clones_df = true_clones_df
         
         column = 'nSeqCDR3' if nt else 'aaSeqCDR3'
-        patterns_end_to_end = []
-        patterns_any = []
-        for row in true_clones.iterrows():
-            patterns_end_to_end += [(row[1][column], tre.compile("^" + row[1][column] + "$"))]
-            #patternsAny += [tre.compile(row[1].cdr3)]
-            patterns_any += [(row[1][column], tre.compile(row[1][column][3:-3]))]
-
-        self.patterns_end_to_end = patterns_end_to_end
-        self.patterns_any = patterns_any
+        self.column = column
+        self.values = list(true_clones_df[column])
+        # integer codes of the values; distinct nucleotide clones may share
+        # an amino acid sequence, which is then one clone
+        self.codes = pd.factorize(true_clones_df[column])[0]
+        self.cache = cache
+        self.fingerprints = {}
+        self.index_end_to_end = CDR3Index(self.values, end_to_end=True)
+        self.index_any = CDR3Index(self.values, end_to_end=False)
+
+    def build(self, mmaxerr):
+        """
+        Builds the end-to-end search index in advance (e.g. before forking
+        worker processes); the substring index is built on first use
+
+        Arguments:
+            mmaxerr -- maximal number of errors of future searches
+        """
+        self.index_end_to_end.build(mmaxerr)
+
+    def search_cdr3_match(self, seq, mmaxerr, end_to_end=True):
+        """
+        Search for the closest true clone
+
+        Returns:
+            (true CDR3 sequence, edit distance) or (nan, nan) if there is
+            no true clone within mmaxerr errors
+        """
+        index = self.index_end_to_end if end_to_end else self.index_any
+        pid, err = index.search(seq, mmaxerr)
+        if pid is None:
+            return np.nan, np.nan
+        return self.values[pid], err
         
     def search_cdr3_seq(self, seq, mmaxerr, end_to_end=True):
-        for maxerr in range(0, 1 + mmaxerr):
-            fuzzyness = tre.Fuzzyness(maxerr = maxerr)
-            for p in (self.patterns_end_to_end if end_to_end else self.patterns_any):
-                if p[1].search(seq, fuzzyness):
-                    return p[0]    
-        return np.nan
+        return self.search_cdr3_match(seq, mmaxerr, end_to_end)[0]
+
+    def match_profile(self, seqs, mmaxerr, end_to_end=True):
+        """
+        Search for the closest true clone for each distinct query sequence
+
+        Arguments:
+            seqs    -- Series of query sequences (may contain duplicates)
+            mmaxerr -- maximal allowed number of errors
+
+        Returns:
+            DataFrame indexed by distinct query sequences with columns:
+                records -- number of occurrences of the sequence in seqs
+                match   -- matched true CDR3 sequence (nan if not matched)
+                code    -- integer code of the matched sequence (-1 if not matched)
+                error   -- edit distance to the match (mmaxerr + 1 if not matched)
+        """
+        index = self.index_end_to_end if end_to_end else self.index_any
+        records = seqs.value_counts(sort=False, dropna=False)
+        queries = [seq for seq in records.index if not pd.isnull(seq)]
+
+        found = {}
+        if self.cache is not None:
+            if end_to_end not in self.fingerprints:
+                mode = '%s:%s' % (self.column, 'end_to_end' if end_to_end else 'any')
+                self.fingerprints[end_to_end] = MatchCache.fingerprint(self.values, mode)
+            found = self.cache.get(self.fingerprints[end_to_end], queries, mmaxerr)
+        searched = dict((seq, index.search(seq, mmaxerr)) for seq in queries if seq not in found)
+        if self.cache is not None:
+            self.cache.put(self.fingerprints[end_to_end], searched, mmaxerr)
+        found.update(searched)
+
+        match = []
+        code = np.full(len(records), -1, dtype=np.int64)
+        error = np.full(len(records), mmaxerr + 1, dtype=np.int32)
+        for i, seq in enumerate(records.index):
+            pid, err = (None, None) if pd.isnull(seq) else found[seq]
+            if pid is None:
+                match.append(np.nan)
+            else:
+                match.append(self.values[pid])
+                code[i] = self.codes[pid]
+                error[i] = err
+        return pd.DataFrame({'records': records.values, 'match': match, 'code': code, 'error': error},
+                            index=records.index)
+
+
+# (nucleotide, amino acid) TrueClonesDb, see get_true_clones_dbs
+_true_clones_dbs = None
+
+def get_true_clones_dbs():
+    """
+    Search databases of the true clones; parsed and indexed on first use
+
+    Returns:
+        (nucleotide TrueClonesDb, amino acid TrueClonesDb)
+    """
+    global _true_clones_dbs
+    if _true_clones_dbs is None:
+        # todo: inferr chains automatically
+        # true_clones = parse_true_reads('TRB').append(parse_true_reads('IGH'), verify_integrity=True, ignore_index=True)
+        with stageTrace.stage('parseTrueReads') as stage:
+            true_clones = parse_true_reads('TRB')
+            stage.add_rows(len(true_clones))
+        match_cache = MatchCache(MATCH_CACHE, MATCH_CACHE_MAX_ENTRIES) if MATCH_CACHE else None
+        with stageTrace.stage('buildIndex') as stage:
+            true_clones_nt_db = TrueClonesDb(true_clones, nt=True, cache=match_cache)
+            true_clones_aa_db = TrueClonesDb(true_clones, nt=False, cache=match_cache)
+            true_clones_nt_db.build(MAX_MAXERR - 1)
+            true_clones_aa_db.build(MAX_MAXERR - 1)
+            stage.add_rows(2 * len(true_clones))
+        _true_clones_dbs = (true_clones_nt_db, true_clones_aa_db)
+    return _true_clones_dbs
+
+
+def discover_samples(star_path=STAR_PATH):
+    """
+    Parse all available BAM files from star/ directory
 
+    Returns:
+        list of sample infos (see parse_bam_file_name) sorted by sample name
+    """
+    return sorted([parse_bam_file_name(f) for f in os.listdir(star_path) if f.endswith('bam')],
+                  key=lambda s: s['sample_name'])
 
-"""
-Parse all available BAM files from star/ directory
-"""
-AllSamples = [parse_bam_file_name(f) for f in os.listdir(STAR_PATH) if f.endswith('bam')]
-# todo: inferr chains automatically
-# true_clones = parse_true_reads('TRB').append(parse_true_reads('IGH'), verify_integrity=True, ignore_index=True)
-true_clones = parse_true_reads('TRB')
-true_clones_nt_db = TrueClonesDb(true_clones, nt=True)
-true_clones_aa_db = TrueClonesDb(true_clones, nt=False)
 
+# file name -> ((size, mtime), SHA-1 of the content)
+_file_hashes = {}
+
+def file_hash(file_name):
+    st = os.stat(file_name)
+    signature = (st.st_size, st.st_mtime_ns)
+    if _file_hashes.get(file_name, (None,))[0] != signature:
+        h = hashlib.sha1()
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _file_hashes[file_name] = (signature, h.hexdigest())
+    return _file_hashes[file_name][1]
+
+def stats_fingerprint(sample, software):
+    """
+    Fingerprint of the inputs of statistics of a (sample, software) pair
+    """
+    h = hashlib.sha1()
+    h.update(('%s:%s' % (STATS_VERSION, MAX_MAXERR)).encode('utf-8'))
+    for file_name in [true_reads_file_name('TRB'), mixcr_file_name(sample) if software == 'mixcr' else trust_file_name(sample)]:
+        h.update(b'\n')
+        h.update(file_hash(file_name).encode('utf-8'))
+    return h.hexdigest()
 
 
 MAX_MAXERR=5
@@ -217,39 +332,116 @@ MAX_MAXERR=5
 def get_stats(df_table, nt=True, prefix=''):
     result = { '%stotal'%prefix : len(df_table) }
     column = 'nSeqCDR3' if nt else 'aaSeqCDR3'
-    db = true_clones_nt_db if nt else true_clones_aa_db
+    db = get_true_clones_dbs()[0 if nt else 1]
+    with stageTrace.stage('matchProfile') as stage:
+        profile = db.match_profile(df_table[column], MAX_MAXERR - 1)
+        stage.add_rows(len(profile))
+    records = profile['records'].values
+    error = profile['error'].values
+    code = profile['code'].values
     for maxerr in range(0, MAX_MAXERR):
-        tmp = df_table[column].apply(lambda seq: db.search_cdr3_seq(seq, maxerr))        
-        result['%smatched_clones_%s'%(prefix,maxerr)] = pd.notnull(tmp.unique()).sum()
-        result['%smatched_records_%s'%(prefix,maxerr)] = pd.notnull(tmp).sum()
-        result['%sunmatched_clones_%s'%(prefix,maxerr)] = len(df_table.loc[tmp.isnull(), column].unique())
-        result['%sunmatched_records_%s'%(prefix,maxerr)] = tmp.isnull().sum()
+        matched = error <= maxerr
+        result['%smatched_clones_%s'%(prefix,maxerr)] = len(np.unique(code[matched]))
+        result['%smatched_records_%s'%(prefix,maxerr)] = int(records[matched].sum())
+        result['%sunmatched_clones_%s'%(prefix,maxerr)] = int((~matched).sum())
+        result['%sunmatched_records_%s'%(prefix,maxerr)] = int(records[~matched].sum())
     return result
 
 
-def merge_dicts(*dict_args):
+def get_sample_stats(task):
     """
-    Given any number of dicts, shallow copy and merge into a new dict,
-    precedence goes to key value pairs in latter dicts.
+    Computes statistics for one (sample, software) pair; executed in worker processes
     """
-    result = {}
-    for dictionary in dict_args:
-        result.update(dictionary)
-    return result
+    sample, software = task
+    with stageTrace.stage('sampleStats', sample=sample['sample_name'], software=software) as stage:
+        table = parse_mixcr_tcr(sample) if software == 'mixcr' else parse_trust(sample)
+        stage.add_rows(len(table))
+        return get_stats(table, prefix='%s_' % software)
 
-AllStats = []
-for sample in AllSamples:
-    mixcr_stats = get_stats(parse_mixcr_tcr(sample), prefix='mixcr_')
-    trust_stats = get_stats(parse_trust(sample), prefix='trust_')
-    AllStats.append(merge_dicts(sample, mixcr_stats, trust_stats))
-    
-AllStats = pd.DataFrame.from_records(AllStats)
 
+def compute_stats(samples, previous=None, processes=STATS_PROCESSES):
+    """
+    Computes statistics for all (sample, software) pairs
 
+    Arguments:
+        samples   -- list of sample infos (see discover_samples)
+        previous  -- optional AllStats of a previous run; statistics with
+                     unchanged input fingerprints are taken from it
+        processes -- number of worker processes
 
+    Returns:
+        AllStats DataFrame with one row per sample: sample info, mixcr_* and
+        trust_* statistics and fingerprints of their inputs
+    """
+    with stageTrace.stage('fingerprints') as stage:
+        fingerprints = dict(((sample['sample_name'], software), stats_fingerprint(sample, software))
+                            for sample in samples for software in SOFTWARES)
+        stage.add_rows(len(fingerprints))
+
+    reused = {}
+    if previous is not None:
+        for row in previous.to_dict('records'):
+            for software in SOFTWARES:
+                key = (row['sample_name'], software)
+                fingerprint = '%s_fingerprint' % software
+                if key in fingerprints and row.get(fingerprint) == fingerprints[key]:
+                    reused[key] = dict((k, v) for k, v in row.items() if k.startswith(software + '_') and k != fingerprint)
+
+    tasks = [(sample, software) for sample in samples for software in SOFTWARES
+             if (sample['sample_name'], software) not in reused]
+    tasks_stats = []
+    if tasks:
+        # built once here, worker processes inherit the indices on fork
+        get_true_clones_dbs()
+        with stageTrace.stage('stats', processes=processes) as stage:
+            if processes > 1:
+                # fork explicitly, it is not the default start method on macOS
+                # (nor on Linux since Python 3.14) and others would pickle the indices
+                with multiprocessing.get_context('fork').Pool(min(processes, len(tasks))) as pool:
+                    # map preserves the order of tasks
+                    tasks_stats = pool.map(get_sample_stats, tasks, chunksize=1)
+            else:
+                tasks_stats = [get_sample_stats(task) for task in tasks]
+            stage.add_rows(len(tasks))
+    computed = dict(((sample['sample_name'], software), stats) for (sample, software), stats in zip(tasks, tasks_stats))
+
+    all_stats = []
+    for sample in samples:
+        record = dict(sample)
+        for software in SOFTWARES:
+            key = (sample['sample_name'], software)
+            record.update(reused[key] if key in reused else computed[key])
+            record['%s_fingerprint' % software] = fingerprints[key]
+        all_stats.append(record)
+    return pd.DataFrame.from_records(all_stats)
+
+
+def load_stats(file_name=STATS_FILE):
+    return pd.read_csv(file_name, sep='\t')
+
+def save_stats(all_stats, file_name=STATS_FILE):
+    tmp_name = '%s.tmp%s' % (file_name, os.getpid())
+    all_stats.to_csv(tmp_name, sep='\t', index=False)
+    os.rename(tmp_name, file_name)
+
+def update_stats(file_name=STATS_FILE, samples=None, processes=STATS_PROCESSES, force=False):
+    """
+    Brings the AllStats table in file_name up to date with the inputs;
+    only statistics with changed inputs are recomputed unless force is set
 
-matplotlib.style.use('default')
-def plot_false_positive_in_silico_left_only(paired=True, star_reference = 'hg37', ax = None):
+    Returns:
+        AllStats DataFrame
+    """
+    if samples is None:
+        samples = discover_samples()
+    previous = load_stats(file_name) if not force and os.path.exists(file_name) else None
+    all_stats = compute_stats(samples, previous, processes)
+    save_stats(all_stats, file_name)
+    return all_stats
+
+
+def plot_false_positive_in_silico_left_only(all_stats, paired=True, star_reference = 'hg37', ax = None):
+    import matplotlib.pyplot as plt
     if ax is None:
         ax = plt.subplot()
 
@@ -261,7 +453,7 @@ def plot_false_positive_in_silico_left_only(paired=True, star_reference = 'hg37'
     width           = 1.5 
     length_offset   = software_offset * len(softwares) + width
     
-    all_data = AllStats[(AllStats.paired == paired) & (AllStats.ref == star_reference)]
+    all_data = all_stats[(all_stats.paired == paired) & (all_stats.ref == star_reference)]
     re_total="(" + "|".join([f.lower() for f in softwares]) + ")_total"
 
     max_total_true_vdj = all_data[all_data.vdj == True].filter(regex=re_total).max().max()
@@ -325,19 +517,57 @@ def panel_letter(ax, letter):
               fontsize=19, fontweight='bold', va='top', ha='right')
 
 
-
-plt.figure(figsize=(14,5))
-
-left = plt.subplot(121)
-plot_false_positive_in_silico_left_only(paired=True, star_reference='hg37',ax=left)
-plt.title('Paired-end')
-panel_letter(left, 'a')
-
-right=plt.subplot(122)
-plot_false_positive_in_silico_left_only(paired=False, star_reference='hg37',ax=right)
-plt.title('Single-end')
-panel_letter(right, 'b')
-
-plt.subplots_adjust(wspace=0.45)
-plt.savefig("SupplementaryFigure_in_silico.pdf")
-
+def render(all_stats, output=FIGURE):
+    """
+    Renders the supplementary figure from AllStats
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    matplotlib.rcParams['pdf.fonttype'] = 42
+    matplotlib.rcParams['font.sans-serif']=["Arial"] 
+    matplotlib.style.use('default')
+
+    plt.figure(figsize=(14,5))
+
+    left = plt.subplot(121)
+    plot_false_positive_in_silico_left_only(all_stats, paired=True, star_reference='hg37',ax=left)
+    plt.title('Paired-end')
+    panel_letter(left, 'a')
+
+    right=plt.subplot(122)
+    plot_false_positive_in_silico_left_only(all_stats, paired=False, star_reference='hg37',ax=right)
+    plt.title('Single-end')
+    panel_letter(right, 'b')
+
+    plt.subplots_adjust(wspace=0.45)
+    plt.savefig(output)
+    plt.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares MiXCR and TRUST on in-silico generated RNA-Seq data')
+    parser.add_argument('--stats', default=STATS_FILE, help='AllStats table (default: %(default)s)')
+    parser.add_argument('--output', default=FIGURE, help='figure file (default: %(default)s)')
+    steps = parser.add_mutually_exclusive_group()
+    steps.add_argument('--stats-only', action='store_true', help='only update the AllStats table')
+    steps.add_argument('--render-only', action='store_true', help='only render the figure from the AllStats table')
+    parser.add_argument('--force', action='store_true', help='recompute all statistics')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='append per-stage timing and memory records to FILE (see stageTrace.py)')
+    args = parser.parse_args()
+    if args.trace:
+        stageTrace.configure(args.trace)
+
+    if args.render_only:
+        all_stats = load_stats(args.stats)
+    else:
+        all_stats = update_stats(args.stats, force=args.force)
+    if not args.stats_only:
+        with stageTrace.stage('plot'):
+            render(all_stats, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Incremental store of false overlap and false extension results
+
+Results are stored in an SQLite database with one row per analysis and
+simulated dataset (fpEstimation_* prefix), keyed by a fingerprint of the
+content of the analysed input files and the version of the analysis, so
+falsePositivesBatch.py only analyses new or changed datasets. Dataset
+parameters are parsed from the prefix once, when a result is stored.
+Results stay in the store when input files are deleted afterwards, but
+only datasets of the latest falsePositivesBatch.py run are reported.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+ANALYSES = ["overlaps", "extensions"]
+# Simulation parameters encoded in dataset prefixes by run-false-positives.sh
+PREFIX_RX = re.compile(r"clones(?P<clones>[0-9]+)_coverage(?P<coverage>[0-9]+)_length(?P<length>[0-9]+)_seq(?P<sequencer>[^_]+)")
+PARAMETERS = ["clones", "coverage", "length", "sequencer"]
+# First bytes of every SQLite database file
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def prefixParameters(prefix):
+    """
+    Simulation parameters of a dataset, None for unknown ones
+    """
+    match = PREFIX_RX.search(os.path.basename(prefix))
+    if match is None:
+        return dict.fromkeys(PARAMETERS)
+    parameters = match.groupdict()
+    for p in ["clones", "coverage", "length"]:
+        parameters[p] = int(parameters[p])
+    return parameters
+
+
+def _numericParameters(results):
+    columns = ["clones", "coverage", "length"]
+    results[columns] = results[columns].apply(pd.to_numeric)
+    return results
+
+
+def isStore(fileName):
+    with open(fileName, "rb") as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+class ResultsStore:
+    """
+    Analysis results keyed by (analysis, dataset prefix) with fingerprints
+    of the inputs they were computed from
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.connectionPid = None
+
+    def _connect(self):
+        # connections can't be shared with forked worker processes
+        if self.connection is None or self.connectionPid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=600)
+            self.connectionPid = os.getpid()
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                         analysis    TEXT NOT NULL,
+                                         prefix      TEXT NOT NULL,
+                                         fingerprint TEXT NOT NULL,
+                                         clones      INTEGER,
+                                         coverage    INTEGER,
+                                         length      INTEGER,
+                                         sequencer   TEXT,
+                                         record      TEXT NOT NULL,
+                                         updated     REAL NOT NULL,
+                                         PRIMARY KEY (analysis, prefix))""")
+            # content hashes of input files, reused while size and mtime are unchanged
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS files (
+                                         path  TEXT PRIMARY KEY,
+                                         size  INTEGER NOT NULL,
+                                         mtime INTEGER NOT NULL,
+                                         hash  TEXT NOT NULL)""")
+            # datasets successfully analysed by the latest run
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS latestRun (
+                                         prefix TEXT PRIMARY KEY)""")
+            self.connection.commit()
+        return self.connection
+
+    def fileHash(self, fileName):
+        """
+        SHA-1 of the file content
+        """
+        connection = self._connect()
+        path = os.path.abspath(fileName)
+        st = os.stat(path)
+        row = connection.execute("SELECT hash FROM files WHERE path = ? AND size = ? AND mtime = ?",
+                                 (path, st.st_size, st.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row[0]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                h.update(block)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                               (path, st.st_size, st.st_mtime_ns, h.hexdigest()))
+        return h.hexdigest()
+
+    def fingerprint(self, fileNames, version):
+        """
+        Fingerprint of an analysis of the input files
+
+        Arguments:
+            fileNames -- ordered list of input files
+            version   -- version of the analysis producing the result
+        """
+        h = hashlib.sha1()
+        h.update(str(version).encode("utf-8"))
+        for fileName in fileNames:
+            h.update(b"\n")
+            h.update(self.fileHash(fileName).encode("utf-8"))
+        return h.hexdigest()
+
+    def current(self, analysis, prefixes):
+        """
+        Stored results
+
+        Arguments:
+            analysis -- "overlaps" or "extensions"
+            prefixes -- dict prefix -> fingerprint of its current inputs
+
+        Returns:
+            dict prefix -> result record, only for prefixes whose stored
+            fingerprint matches
+        """
+        connection = self._connect()
+        rows = connection.execute("SELECT prefix, fingerprint, record FROM results WHERE analysis = ?", (analysis,))
+        return dict((prefix, json.loads(record)) for prefix, fingerprint, record in rows
+                    if prefixes.get(prefix) == fingerprint)
+
+    def put(self, analysis, prefix, fingerprint, record):
+        """
+        Stores the result of an analysis of a dataset, replacing previous one
+        """
+        parameters = prefixParameters(prefix)
+        connection = self._connect()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               [analysis, prefix, fingerprint] + [parameters[p] for p in PARAMETERS] +
+                               [json.dumps(record), time.time()])
+
+    def remove(self, analysis, prefix):
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM results WHERE analysis = ? AND prefix = ?", (analysis, prefix))
+
+    def setLatestRun(self, prefixes):
+        """
+        Records datasets of the latest run, the only ones returned by results()
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM latestRun")
+            connection.executemany("INSERT INTO latestRun VALUES (?)", [(prefix,) for prefix in prefixes])
+
+    def results(self, analysis):
+        """
+        Stored results of an analysis for datasets of the latest run as a
+        DataFrame with one row per dataset: result record fields and
+        simulation parameters
+        """
+        connection = self._connect()
+        rows = connection.execute("SELECT %s, record FROM results WHERE analysis = ? AND prefix IN "
+                                  "(SELECT prefix FROM latestRun) ORDER BY prefix"
+                                  % ", ".join(PARAMETERS), (analysis,)).fetchall()
+        records = []
+        for row in rows:
+            record = json.loads(row[-1])
+            record.update(zip(PARAMETERS, row[:-1]))
+            records.append(record)
+        return _numericParameters(pd.DataFrame.from_records(records, columns=None if records else PARAMETERS))
+
+
+def readResults(fileName, analysis):
+    """
+    Results of an analysis with simulation parameters from a results store
+    or from JSONL written by getFalseOverlaps.py/getFalseExtensions.py
+    """
+    if isStore(fileName):
+        return ResultsStore(fileName).results(analysis)
+    results = pd.read_json(fileName, lines=True)
+    parameters = pd.DataFrame.from_records([prefixParameters(f) for f in results.inputFile], columns=PARAMETERS)
+    return _numericParameters(pd.concat([results, parameters], axis=1))
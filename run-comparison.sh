@@ -312,7 +312,7 @@ fi
 
 if [ -z "${NO_TRUST}" ]; then
 	log "Running TRUST"
-	ls -1 ${STAR_OUTPUT}/*.bam | parallel "python ${TRUST_BINARIES}/TRUST.py -f {} -a -H -o ${TRUST_OUTPUT}/"
+	ls -1 ${STAR_OUTPUT}/*.bam | parallel "python2 ${TRUST_BINARIES}/TRUST.py -f {} -a -H -o ${TRUST_OUTPUT}/"
 fi
 
 
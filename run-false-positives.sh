@@ -79,11 +79,14 @@ export -f create_data
 parallel -j4 --line-buffer "create_data {1} {2} {3} {4}" ::: 100 1000 10000 ::: 10000 100000 ::: 50 75 100 ::: HS20 HS25
 parallel -j4 --line-buffer "create_data {1} {2} {3} {4}" ::: 100 1000 10000 ::: 10000 100000 ::: 50 75 ::: NS50
 
-# Calculating false overlap rates
-ls -1 *_overlaps.txt | sed 's:_overlaps.txt::' | parallel "python $dir/getFalseOverlaps.py {}_readToDescr.txt {}_overlaps.txt {}_rescued_extended_assemble.report" > falseOverlapsResults.txt
-# Calculating false extension rates
-ls -1 *_overlaps.txt | sed 's:_overlaps.txt::' | parallel "python $dir/getFalseExtensions.py {}_extends.txt {}_rescued_extended_assemble.report" > falseExtensionsResults.txt
+# Calculating false overlap and false extension rates (only for new or changed datasets)
+python $dir/falsePositivesBatch.py --store falsePositivesResults.sqlite --quality-sweep 0:40:5
 
 # Calculating overall statisics
-python $dir/falseExtensionsStat.py falseExtensionsResults.txt
-python $dir/falseOverlapsStat.py falseOverlapsResults.txt
+python $dir/falseExtensionsStat.py falsePositivesResults.sqlite
+python $dir/falseOverlapsStat.py falsePositivesResults.sqlite
+
+# Per-stage timings and memory usage, if tracing is enabled (STAGE_TRACE=trace.jsonl)
+if [ -n "$STAGE_TRACE" ]; then
+    python $dir/traceSummary.py $STAGE_TRACE
+fi
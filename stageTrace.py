@@ -0,0 +1,159 @@
+"""
+Lightweight per-stage instrumentation of the analysis scripts
+
+Tracing is disabled unless the STAGE_TRACE environment variable names a
+file (or a script is run with --trace FILE). Every finished stage appends
+one JSON record to that file, e.g.:
+
+    {"script": "getFalseOverlaps.py", "pid": 4242, "stage": "readIdIndex",
+     "start": 1531785600.0, "wall": 1.21, "cpu": 1.18, "rows": 1000000,
+     "maxrss": 104857600}
+
+Nested stages are named by their path. maxrss is the peak RSS of the process
+so far (bytes); with STAGE_TRACE_MEMORY=1 records also contain traced_peak,
+the peak of memory allocated by Python during the stage (tracemalloc, which
+slows allocations down). Processes running concurrently (e.g. under GNU
+parallel or in a process pool) may share one trace file; traceSummary.py
+aggregates it into a per-stage table.
+"""
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+TRACE_ENV = 'STAGE_TRACE'
+MEMORY_ENV = 'STAGE_TRACE_MEMORY'
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+_path = None
+_memory = False
+_stack = []
+
+
+class Stage:
+    """
+    A running stage; fields set here are added to its trace record
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.rows = None
+        self.traced_peak = 0
+
+    def add_rows(self, rows):
+        """
+        Adds to the number of rows processed by the stage
+        """
+        self.rows = (self.rows or 0) + int(rows)
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+class _NullStage:
+    """
+    Stage used when tracing is disabled
+    """
+
+    def add_rows(self, rows):
+        pass
+
+    def set(self, **fields):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+def configure(path, memory=None):
+    """
+    Enables tracing into path (None disables it); child processes started
+    afterwards inherit the settings
+
+    Arguments:
+        path   -- trace file, records are appended
+        memory -- whether to record tracemalloc peaks (default: STAGE_TRACE_MEMORY)
+    """
+    global _path, _memory
+    _path = path or None
+    if memory is not None:
+        _memory = memory
+    if _path:
+        os.environ[TRACE_ENV] = _path
+        os.environ[MEMORY_ENV] = '1' if _memory else '0'
+    if _path and _memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def enabled():
+    return _path is not None
+
+
+def _traced_peak():
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    return peak
+
+
+def _write(record):
+    with open(_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Times a named stage:
+
+        with stageTrace.stage('read', file=name) as s:
+            ...
+            s.add_rows(len(table))
+
+    Does nothing if tracing is disabled.
+    """
+    if _path is None:
+        yield NULL_STAGE
+        return
+
+    memory = _memory and tracemalloc.is_tracing()
+    if memory and _stack:
+        _stack[-1].traced_peak = max(_stack[-1].traced_peak, _traced_peak())
+    elif memory:
+        tracemalloc.reset_peak()
+    current = Stage('/'.join([s.name for s in _stack[-1:]] + [name]), fields)
+    _stack.append(current)
+    start, cpu = time.time(), time.process_time()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _stack.pop()
+        record = {
+            'script': os.path.basename(sys.argv[0]),
+            'pid': os.getpid(),
+            'stage': current.name,
+            'start': start,
+            'wall': time.time() - start,
+            'cpu': time.process_time() - cpu,
+            'rows': current.rows,
+            'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+        }
+        if memory:
+            record['traced_peak'] = max(current.traced_peak, _traced_peak())
+            if _stack:
+                _stack[-1].traced_peak = max(_stack[-1].traced_peak, record['traced_peak'])
+        if error is not None:
+            record['error'] = error
+        record.update(current.fields)
+        _write(record)
+
+
+configure(os.environ.get(TRACE_ENV), os.environ.get(MEMORY_ENV) == '1')
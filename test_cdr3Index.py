@@ -0,0 +1,53 @@
+import random
+
+from cdr3Index import CDR3Index, edit_distance, substring_distance
+
+MAXERR = 4
+
+
+def random_clones(rng, n, length=45):
+    return [''.join(rng.choice('ACGT') for _ in range(length)) for _ in range(n)]
+
+
+def mutate(rng, s, k):
+    s = list(s)
+    for _ in range(k):
+        p = rng.randrange(len(s))
+        s[p] = 'ACGT'[('ACGT'.index(s[p]) + rng.randrange(1, 4)) % 4]
+    return ''.join(s)
+
+
+def brute_force(index, seq, maxerr):
+    distance = edit_distance if index.end_to_end else substring_distance
+    best, best_err = None, maxerr + 1
+    for pid, pattern in enumerate(index.patterns):
+        err = distance(pattern, seq, maxerr)
+        if err < best_err:
+            best, best_err = pid, err
+    return (best, best_err) if best is not None else (None, None)
+
+
+def test_search_finds_closest_clone():
+    rng = random.Random(1)
+    clones = random_clones(rng, 100)
+    for end_to_end in [True, False]:
+        index = CDR3Index(clones, end_to_end=end_to_end)
+        for _ in range(50):
+            query = mutate(rng, rng.choice(clones), rng.randrange(MAXERR + 3))
+            if not end_to_end:
+                query = 'TGT' + query + 'TTT'
+            assert index.search(query, MAXERR) == brute_force(index, query, MAXERR)
+
+
+def test_substring_candidates_are_few():
+    rng = random.Random(2)
+    clones = random_clones(rng, 2000)
+    index = CDR3Index(clones, end_to_end=False)
+    index.build(MAXERR)
+    for _ in range(50):
+        pid = rng.randrange(len(clones))
+        query = mutate(rng, clones[pid], rng.randrange(MAXERR + 1))
+        candidates = index._substring_candidates(query, MAXERR)
+        assert pid in [c for _, c in candidates]
+        # only clones sharing a whole piece with the query are verified
+        assert len(candidates) < 0.02 * len(clones)
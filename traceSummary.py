@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Summarizes stage trace records (see stageTrace.py) into a per-stage table
+
+    STAGE_TRACE=trace.jsonl ./run-false-positives.sh
+    python traceSummary.py trace.jsonl
+
+Records of all processes of a run (e.g. written by GNU parallel jobs or pool
+workers into one or several files) are aggregated by script and stage: total
+and maximal wall time, span (from the first start to the last end, which is
+less than the total for stages running in parallel), CPU time, processed
+rows and the peak memory.
+"""
+import argparse
+import sys
+
+import pandas as pd
+
+COLUMNS = ['script', 'stage', 'calls', 'processes', 'errors', 'wall', 'wall_max', 'span', 'cpu', 'rows',
+           'rows_per_s', 'maxrss_mb', 'traced_peak_mb']
+
+
+def read_traces(file_names):
+    """
+    Reads trace records from JSONL files into one DataFrame
+    """
+    traces = [pd.read_json(f, lines=True) for f in file_names]
+    traces = [t for t in traces if len(t) > 0]
+    if not traces:
+        return pd.DataFrame(columns=['script', 'pid', 'stage', 'start', 'wall', 'cpu', 'rows', 'maxrss'])
+    return pd.concat(traces, ignore_index=True, sort=False)
+
+
+def summarize(traces, by=()):
+    """
+    Aggregates trace records by script, stage and additional fields
+
+    Arguments:
+        traces -- DataFrame with trace records
+        by     -- additional record fields to group by (e.g. 'sample')
+
+    Returns:
+        DataFrame with one row per group
+    """
+    keys = ['script', 'stage'] + list(by)
+    traces = traces.copy()
+    for column in ['rows', 'traced_peak', 'error']:
+        if column not in traces.columns:
+            traces[column] = None
+    traces['end'] = traces['start'] + traces['wall']
+    grouped = traces.groupby(keys, sort=False, dropna=False)
+    summary = grouped.agg(calls=('wall', 'size'), processes=('pid', 'nunique'), errors=('error', 'count'),
+                          wall=('wall', 'sum'), wall_max=('wall', 'max'), start=('start', 'min'), end=('end', 'max'),
+                          cpu=('cpu', 'sum'), rows=('rows', lambda r: r.sum(min_count=1)), maxrss=('maxrss', 'max'),
+                          traced_peak=('traced_peak', 'max'))
+    summary['span'] = summary['end'] - summary['start']
+    summary['rows_per_s'] = pd.to_numeric(summary['rows']) / summary['wall']
+    summary['rows'] = summary['rows'].astype('Int64')
+    summary['maxrss_mb'] = summary['maxrss'] / 2.0 ** 20
+    summary['traced_peak_mb'] = pd.to_numeric(summary['traced_peak']) / 2.0 ** 20
+    summary = summary.reset_index()
+    return summary[keys + COLUMNS[2:]]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarizes stage trace records into a per-stage table')
+    parser.add_argument('traces', nargs='+', help='JSONL trace files (STAGE_TRACE)')
+    parser.add_argument('--by', action='append', default=[],
+                        help='additional record field to group by, e.g. sample (may be repeated)')
+    parser.add_argument('--tsv', action='store_true', help='write tab-separated values instead of a text table')
+    args = parser.parse_args()
+
+    summary = summarize(read_traces(args.traces), args.by)
+    if args.tsv:
+        summary.to_csv(sys.stdout, sep='\t', index=False, na_rep='NA')
+    else:
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 250):
+            summary['rows'] = summary['rows'].astype(object).where(summary['rows'].notna(), '')
+            print(summary.to_string(index=False, na_rep='', float_format=lambda v: '%.3f' % v))